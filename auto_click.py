@@ -18,6 +18,7 @@
 """
 
 import os
+import math
 import time
 import random
 import cv2
@@ -27,10 +28,14 @@ import logging
 import json
 import glob
 import threading
-from queue import Queue
+from queue import Queue, Empty
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import msvcrt
 import re
 import subprocess
+import struct
+from types import SimpleNamespace
 from datetime import datetime, timedelta
 
 # 配置日志
@@ -40,6 +45,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 模板匹配已由扫描线程池按模板并行，OpenCV内部不再另开线程，避免线程数超过CPU核数
+cv2.setNumThreads(1)
+
 class YuhunAutomation:
     """
     御魂自动化类 v1.0
@@ -55,6 +63,9 @@ class YuhunAutomation:
         self.clicker.emulator_address = device_id
         self.is_running = True
         self.total_runs = 0
+        # 帧指纹缓存：画面未变化且上次完整扫描没有任何匹配时，跳过模板扫描
+        self._last_frame_hash = None
+        self._last_frame_had_no_match = False
         
     def run(self, template_configs: Dict[str, Dict], stop_event: threading.Event, pause_event: threading.Event):
         """运行御魂自动化"""
@@ -70,91 +81,105 @@ class YuhunAutomation:
             try:
                 # 检查是否需要暂停
                 if pause_event.is_set():
-                    time.sleep(1)
+                    stop_event.wait(1)
                     continue
                 
                 # 获取屏幕截图
                 screen = self.clicker.get_screen()
                 if screen is None:
-                    time.sleep(1)
+                    stop_event.wait(1)
                     continue
                 
+                # 画面与上一帧相同且上一帧没有任何匹配，无需重新匹配
+                frame_hash = self.clicker.frame_hash(screen)
+                if frame_hash == self._last_frame_hash and self._last_frame_had_no_match:
+                    stop_event.wait(0.2)
+                    continue
+                self._last_frame_hash = frame_hash
+                self._last_frame_had_no_match = False
+                
+                # lose、notupo和所有按钮在同一帧上一次匹配完
+                # 刚点击button10的1秒内只检测notupo，不匹配按钮
+                check_notupo = self.clicker.check_notupo_after_button10
+                waiting_notupo = check_notupo and time.time() - self.clicker.last_button10_click_time <= 1
+                button_names = [] if waiting_notupo else self.clicker.scan_order(self.clicker.get_template_names())
+                results = self.clicker.match_many(
+                    screen, ["lose"] + (["notupo"] if check_notupo else []) + button_names
+                )
+                
                 # 检查lose和notupo
-                lose_pos = self.clicker.find_template("lose", screen)
-                if lose_pos:
-                    logger.info(f"{datetime.now().strftime('%H:%M:%S')} - {self.device_info} 检测到lose")
+                if results["lose"]:
+                    logger.info(f"{self.device_info} 检测到lose")
                     pause_event.set()
                     return
                 
                 # 如果刚点击了button10，立即检查notupo
-                if self.clicker.check_notupo_after_button10:
-                    notupo_pos = self.clicker.find_template("notupo", screen)
-                    if notupo_pos:
-                        logger.info(f"{datetime.now().strftime('%H:%M:%S')} - {self.device_info} 检测到notupo")
+                if check_notupo:
+                    if results["notupo"]:
+                        logger.info(f"{self.device_info} 检测到notupo")
                         pause_event.set()
                         return
-                    # 如果距离点击button10超过1秒还没检测到notupo，就继续正常流程
-                    if time.time() - self.clicker.last_button10_click_time > 1:
+                    # 如果距离点击button10超过1秒还没检测到notupo，就继续正常流程；
+                    # 否则短暂等待后重新截图检测，等待期间收到停止信号立即退出
+                    if not waiting_notupo:
                         self.clicker.check_notupo_after_button10 = False
                     else:
-                        time.sleep(0.1)
+                        stop_event.wait(0.1)
                         continue
                 
-                # 检查其他按钮
+                # 按优先级取第一个匹配的按钮
+                hit = next(((name, results[name]) for name in button_names if results[name]), None)
+                if hit is None:
+                    # 完整扫描过所有模板且没有任何匹配，记录下来供下一帧短路
+                    self._last_frame_had_no_match = True
+                    stop_event.wait(0.2)
+                    continue
+                    
+                if stop_event.is_set() or pause_event.is_set():
+                    continue
+                    
+                template_name, (x, y) = hit
                 clicked = False
-                for template_name in self.clicker.get_template_names():
-                    # 再次检查是否超时
-                    if time.time() - start_time > max_run_time:
-                        return  # 超过最大执行时间，退出本次run调用
-                        
-                    if stop_event.is_set() or pause_event.is_set():
-                        break
-                        
-                    pos = self.clicker.find_template(template_name, screen)
-                    if pos:
-                        x, y = pos
-                        
-                        # 特殊处理button10
-                        if template_name == "button10":
-                            if self.clicker.random_click(x, y, template_name):
-                                self.clicker.last_button10_click_time = time.time()
-                                self.clicker.check_notupo_after_button10 = True
-                                logger.info(f"{datetime.now().strftime('%H:%M:%S')} - {self.device_info} 点击 button10")
-                                clicked = True
-                                break
-                        
-                        # 特殊处理button7
-                        elif template_name == "button7":
-                            # 检查是否会超时
-                            wait_time = random.uniform(self.clicker.button7_wait_range[0], self.clicker.button7_wait_range[1])
-                            if time.time() - start_time + wait_time > max_run_time:
-                                return  # 等待会导致超时，所以直接返回
-                            time.sleep(wait_time)
-                            if self.clicker.random_click(x, y, template_name):
-                                logger.info(f"{datetime.now().strftime('%H:%M:%S')} - {self.device_info} 点击 button7")
-                                clicked = True
-                                # 检查延迟是否会导致超时
-                                if time.time() - start_time + 1 > max_run_time:  # 假设延迟最多1秒
-                                    return
-                                self.clicker.random_delay(template_name)
-                                break
-                        
-                        # 处理其他按钮
-                        else:
-                            if self.clicker.random_click(x, y, template_name):
-                                clicked = True
-                                # 检查延迟是否会导致超时
-                                if time.time() - start_time + 1 > max_run_time:  # 假设延迟最多1秒
-                                    return
-                                self.clicker.random_delay(template_name)
-                                break
+                
+                # 特殊处理button10
+                if template_name == "button10":
+                    if self.clicker.random_click(x, y, template_name):
+                        self.clicker.last_button10_click_time = time.time()
+                        self.clicker.check_notupo_after_button10 = True
+                        logger.info(f"{self.device_info} 点击 button10")
+                        clicked = True
+                
+                # 特殊处理button7
+                elif template_name == "button7":
+                    # 检查是否会超时
+                    wait_time = random.uniform(self.clicker.button7_wait_range[0], self.clicker.button7_wait_range[1])
+                    if time.time() - start_time + wait_time > max_run_time:
+                        return  # 等待会导致超时，所以直接返回
+                    if stop_event.wait(wait_time):
+                        return
+                    if self.clicker.random_click(x, y, template_name):
+                        logger.info(f"{self.device_info} 点击 button7")
+                        clicked = True
+                        # 检查延迟是否会导致超时
+                        if time.time() - start_time + 1 > max_run_time:  # 假设延迟最多1秒
+                            return
+                        self.clicker.random_delay(template_name)
+                
+                # 处理其他按钮
+                else:
+                    if self.clicker.random_click(x, y, template_name):
+                        clicked = True
+                        # 检查延迟是否会导致超时
+                        if time.time() - start_time + 1 > max_run_time:  # 假设延迟最多1秒
+                            return
+                        self.clicker.random_delay(template_name)
                 
                 if not clicked:
-                    time.sleep(0.2)
+                    stop_event.wait(0.2)
                     
             except Exception as e:
-                logger.error(f"{datetime.now().strftime('%H:%M:%S')} - {self.device_info} 错误: {str(e)}")
-                time.sleep(1)
+                logger.error(f"{self.device_info} 错误: {str(e)}")
+                stop_event.wait(1)
 
 class DeviceThread(threading.Thread):
     """
@@ -173,6 +198,12 @@ class DeviceThread(threading.Thread):
         self.stop_event = stop_event
         self.pause_event = threading.Event()
         self.automation = YuhunAutomation(device_id, device_info)
+        # 设备线程只采用主程序按钮配置中的roi，阈值等仍使用设备自己的配置
+        button_config = self.automation.clicker.button_config
+        for name, config in template_configs.items():
+            if 'roi' in config:
+                button_config.setdefault(name, {})['roi'] = config['roi']
+        self.automation.clicker.refresh_template_configs()
         self.start_time = None
         self.run_duration = run_duration  # 运行时长（分钟）
         
@@ -209,6 +240,7 @@ class DeviceThread(threading.Thread):
         except Exception as e:
             logger.error(f"设备 {self.device_info} 线程运行出错: {str(e)}")
         finally:
+            self.automation.clicker.close_shell()
             run_time = datetime.now() - self.start_time
             hours = run_time.total_seconds() / 3600
             logger.info(f"设备 {self.device_info} 实际运行时间: {hours:.2f} 小时")
@@ -221,6 +253,25 @@ class AutoClicker:
     - 智能按钮处理
     - 多设备管理
     """
+    # getprop输出的每一行形如: [ro.product.model]: [MuMu]
+    _GETPROP_RE = re.compile(r'^\[([^\]]+)\]: \[(.*)\]\s*$', re.MULTILINE)
+    # 从进程信息中提取ADB端口
+    _PORT_RE = re.compile(r'port\s*(\d+)')
+    # 文本中的连续数字
+    _DIGITS_RE = re.compile(r'\d+')
+    # 模拟器进程的特征
+    EMULATOR_PATTERNS = {
+        "MuMu": ["MuMu", "MuMu12", "MuMu12-2"],
+        "LDPlayer": ["LDPlayer", "dnconsole", "dnplayer"],
+        "Xiaomi": ["Xiaomi"],
+        "HUAWEI": ["HUAWEI"],
+        "Samsung": ["Samsung"]
+    }
+    # 点击偏移方向查找表：把圆周等分为256个方向，预先算好(cos, sin)
+    OFFSET_LUT = [(math.cos(2 * math.pi * i / 256), math.sin(2 * math.pi * i / 256)) for i in range(256)]
+    # 所有设备共用的模板匹配线程池，cv2.matchTemplate执行时会释放GIL
+    _scan_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix='scan')
+
     def __init__(self):
         # ADB路径
         self.adb_path = r"F:\testclinm\platform-tools\adb.exe"
@@ -228,10 +279,10 @@ class AutoClicker:
         self.image_dir = r"F:\testclinm\templates"
         # 配置文件路径
         self.config_dir = os.path.join(os.path.dirname(self.adb_path), 'config')
-        if not os.path.exists(self.config_dir):
-            os.makedirs(self.config_dir)
+        os.makedirs(self.config_dir, exist_ok=True)
         self.emulator_config_file = os.path.join(self.config_dir, 'emulators.json')
         self.button_config_file = os.path.join(self.image_dir, 'button_config.json')
+        self.template_cache_file = os.path.join(self.image_dir, 'templates_cache.npz')
         
         # 图像匹配阈值
         self.threshold = 0.8  # 默认阈值
@@ -253,6 +304,10 @@ class AutoClicker:
         # 特殊图片配置
         self.button_config['notupo'] = {'threshold': 0.5, 'type': 'special'}
         self.button_config['lose'] = {'threshold': 0.8, 'type': 'special'}  # 修改lose的阈值为0.8
+        # 合并默认值后的每个模板配置 {模板名称: SimpleNamespace}，按钮配置变化后清空重建
+        self._cfg: Dict[str, SimpleNamespace] = {}
+        # 按优先级排好的扫描顺序 {模板名称元组: 排序后的模板名称列表}
+        self._scan_orders: Dict[Tuple[str, ...], List[str]] = {}
         # 固定流程状态
         self.fixed_sequence_state = 0  # 0: 等待button11, 1: 等待button12, 2: 等待button4
         # 线程控制
@@ -271,7 +326,282 @@ class AutoClicker:
         # 添加button10和notupo的状态跟踪
         self.last_button10_click_time = 0  # 记录最后一次点击button10的时间
         self.check_notupo_after_button10 = False  # 是否在点击button10后检查notupo
-        
+
+        # 常驻的adb shell进程，点击和滑动命令通过它的标准输入发送
+        self._shell = None
+        self._shell_address = None
+
+        # 设备属性缓存 {device_id: {属性名: 属性值}}
+        self._props_cache: Dict[str, Dict[str, str]] = {}
+
+        # 模拟器进程特征合并为一个正则（长特征优先），并记录特征到模拟器类型的映射
+        self._emulator_type_of = {
+            pattern.lower(): emulator_type
+            for emulator_type, patterns in self.EMULATOR_PATTERNS.items()
+            for pattern in patterns
+        }
+        self._emulator_pattern = re.compile(
+            '|'.join(re.escape(p) for p in sorted(self._emulator_type_of, key=len, reverse=True)),
+            re.IGNORECASE
+        )
+
+        # 模板缓存（运行期间模板图片不会变化，启动时一次性加载）
+        self._template_names_cached: Optional[List[str]] = None
+        self._templates: Dict[str, np.ndarray] = {}  # 灰度模板
+        self._template_lock = threading.Lock()
+        self._missing_templates = set()  # 读取失败的模板，不再重复读盘
+        self._bad_rois = set()  # roi配置无效的模板（只警告一次）
+        # 模板匹配数据按结构数组（SoA）存放，按加载顺序用下标索引
+        self._tmpl_index: Dict[str, int] = {}
+        self._tmpl_data: List[np.ndarray] = []  # 灰度模板
+        # 各列用列表保存：注册模板时追加为O(1)，匹配时只按下标取单个值
+        self._tmpl_h: List[int] = []
+        self._tmpl_w: List[int] = []
+        self._tmpl_ssd: List[float] = []  # 去均值后的平方和
+        self._template_small: Dict[str, np.ndarray] = {}
+        self._template_level: Dict[str, int] = {}  # 粗匹配所用的金字塔层，0表示直接在原分辨率上匹配
+        # 整帧匹配结果的预分配缓冲区（按模拟器分辨率计算尺寸，每帧复用）
+        self.screen_size = (1280, 720)  # 模拟器分辨率（宽, 高）
+        self._match_buffers: Dict[str, np.ndarray] = {}
+
+        # 金字塔匹配：先在缩小的灰度图上粗匹配，再在原分辨率的候选区域内精匹配
+        self.pyramid_levels = 2  # 最多缩小 2^levels 倍
+        self.pyramid_margin = 0.2  # 粗匹配阈值放宽量（与modules/core.py的PYRAMID_MARGIN相同）
+        self.pyramid_min_coarse = 8  # 缩小后模板短边至少保留的像素数，不足时少缩一层
+        # 当前帧的金字塔缓存 [原分辨率灰度图, 1/2, 1/4, ...]（同一帧内所有模板共用）
+        self._frame_source = None
+        self._frame_pyramid: List[np.ndarray] = []
+        self._frame_hash = None
+        # OpenCL（T-API）：有可用的OpenCL设备时整帧匹配改用cv2.UMat，交给GPU计算
+        # （创建点击器前调用 cv2.ocl.setUseOpenCL(False) 可关闭）
+        self._opencl = cv2.ocl.haveOpenCL() and cv2.ocl.useOpenCL()
+        self._frame_umats: Dict[int, cv2.UMat] = {}  # 当前帧各层金字塔上传后的UMat
+        self._template_umats: Dict[str, cv2.UMat] = {}  # 上传后的模板（整帧匹配所用的那一层）
+        # 按帧指纹缓存最近几帧的匹配结果 {帧指纹: {模板名称: 位置或None}}，点击或滑动后清空
+        self._match_cache: OrderedDict = OrderedDict()
+        self.match_cache_size = 16
+        # 最近一次截图 (截图时间, 图像)，有效期内重复获取截图直接复用，点击或滑动后作废
+        self._screen_cache: Optional[Tuple[float, np.ndarray]] = None
+        self.screen_ttl = 0.05  # 秒
+        # 原始截图解码用的BGR和灰度缓冲区，首帧或分辨率变化时分配，之后每帧原地覆盖
+        # （每个设备线程有自己的点击器，缓冲区不会被其它线程写入）
+        self._screen_buf: Optional[np.ndarray] = None
+        self._gray_buf: Optional[np.ndarray] = None
+
+        # 预生成的[0, 1)随机数池，点击、延迟和滑动从池中取数，用完后整体重新生成
+        # 每个点击器使用独立的生成器，多设备线程之间不共享随机数状态
+        self._rng = np.random.default_rng()
+        self._rand_pool_size = 4096
+        self._rand_pool = self._rng.random(self._rand_pool_size)
+        self._rand_index = 0
+
+        self.load_templates()
+
+    def load_templates(self):
+        """预加载所有按钮模板到内存（优先从预处理好的灰度模板缓存文件读取）"""
+        template_names = self.get_template_names()
+        cached = self._load_template_cache(template_names)
+        with self._template_lock:
+            for template_name, template_gray in cached.items():
+                if template_name not in self._templates:
+                    self._register_template(template_name, template_gray)
+        for template_name in template_names:
+            self._load_template(template_name)
+        # 缓存文件缺少模板或已过期时，用刚解码的模板重新生成
+        if any(name in self._templates and name not in cached for name in template_names):
+            self._save_template_cache(template_names)
+        logger.info(f"已缓存 {len(self._templates)} 个模板图片")
+
+    def _load_template_cache(self, template_names: List[str]) -> Dict[str, np.ndarray]:
+        """读取灰度模板缓存文件，任一PNG比缓存新时视为过期"""
+        try:
+            cache_mtime = os.path.getmtime(self.template_cache_file)
+            for template_name in template_names:
+                png_path = os.path.join(self.image_dir, f"{template_name}.png")
+                if os.path.getmtime(png_path) > cache_mtime:
+                    return {}
+            with np.load(self.template_cache_file, allow_pickle=False) as data:
+                return {name: data[name] for name in template_names if name in data.files}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"读取模板缓存失败: {str(e)}")
+            return {}
+
+    def _save_template_cache(self, template_names: List[str]):
+        """把已加载的灰度模板写入缓存文件（先写临时文件再替换）"""
+        arrays = {name: self._templates[name] for name in template_names if name in self._templates}
+        temp_file = self.template_cache_file + '.tmp'
+        try:
+            with open(temp_file, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(temp_file, self.template_cache_file)
+            logger.info(f"已生成模板缓存: {self.template_cache_file}")
+        except Exception as e:
+            logger.warning(f"保存模板缓存失败: {str(e)}")
+
+    def _load_template(self, template_name: str) -> Optional[np.ndarray]:
+        """读取单个模板图片并写入缓存"""
+        template = self._templates.get(template_name)
+        if template is not None:
+            return template
+        # 扫描线程池中可能有多个线程同时加载同一个模板
+        if template_name in self._missing_templates:
+            return None
+        with self._template_lock:
+            template = self._templates.get(template_name)
+            if template is not None:
+                return template
+            template = self._read_template(template_name)
+            if template is None:
+                logger.error(f"无法读取模板图片: {template_name}")
+                self._missing_templates.add(template_name)
+            return template
+
+    def _read_template(self, template_name: str) -> Optional[np.ndarray]:
+        """从磁盘读取模板图片，写入模板表（调用方需持有_template_lock）"""
+        template_path = os.path.join(self.image_dir, f"{template_name}.png")
+        # 匹配只用灰度图，直接按灰度解码，不保留彩色副本
+        template_gray = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
+        if template_gray is None:
+            return None
+        return self._register_template(template_name, template_gray)
+
+    def _register_template(self, template_name: str, template_gray: np.ndarray) -> np.ndarray:
+        """把灰度模板写入模板表并预计算匹配数据（调用方需持有_template_lock）"""
+        h, w = template_gray.shape[:2]
+        mean = float(template_gray.mean())
+        zero_mean = template_gray.astype(np.float32) - mean
+        ssd = float((zero_mean * zero_mean).sum())
+        if ssd == 0:
+            logger.warning(f"模板图片 {template_name} 为纯色，无法用于匹配")
+
+        self._tmpl_index[template_name] = len(self._tmpl_index)
+        self._tmpl_data.append(template_gray)
+        self._tmpl_h.append(h)
+        self._tmpl_w.append(w)
+        self._tmpl_ssd.append(ssd)
+        # 按模板大小选择粗匹配的层数：大模板多缩几层，小模板缩小后细节丢失严重，
+        # 连一层都缩不了时直接走原分辨率匹配
+        level = self.pyramid_levels
+        while level > 0 and (min(h, w) >> level) < self.pyramid_min_coarse:
+            level -= 1
+        self._template_level[template_name] = level
+        if level:
+            self._template_small[template_name] = self._pyr_down(template_gray, level)
+        self._match_buffers[template_name] = self._alloc_match_buffer(template_name)
+        # 最后写入，其它线程看到模板时模板表已经完整
+        self._templates[template_name] = template_gray
+        return template_gray
+
+    def _alloc_match_buffer(self, template_name: str) -> np.ndarray:
+        """按屏幕分辨率为模板的整帧匹配分配结果缓冲区"""
+        screen_w, screen_h = self.screen_size
+        level = self._template_level[template_name]
+        if not level:
+            template = self._tmpl_data[self._tmpl_index[template_name]]
+        else:
+            # 粗匹配在缩小图上进行，每层pyrDown尺寸减半（向上取整）
+            for _ in range(level):
+                screen_w, screen_h = (screen_w + 1) // 2, (screen_h + 1) // 2
+            template = self._template_small[template_name]
+        h, w = template.shape[:2]
+        return np.empty((max(screen_h - h + 1, 1), max(screen_w - w + 1, 1)), dtype=np.float32)
+
+    def _resize_match_buffers(self, screen_size: Tuple[int, int]):
+        """截图分辨率变化时按新分辨率重新分配所有模板的结果缓冲区"""
+        logger.info(f"截图分辨率为 {screen_size[0]}x{screen_size[1]}，重新分配匹配缓冲区")
+        with self._template_lock:
+            self.screen_size = screen_size
+            for template_name in self._templates:
+                self._match_buffers[template_name] = self._alloc_match_buffer(template_name)
+
+    def _match_full(self, template_name: str, image: np.ndarray, template: np.ndarray,
+                    frame_level: Optional[int] = None, method: int = cv2.TM_CCOEFF_NORMED):
+        """整帧匹配，结果尺寸与预分配缓冲区一致时直接写入缓冲区
+
+        frame_level 表示 image 是当前帧金字塔的第几层（roi切片时为None），
+        启用OpenCL时整层图像每帧只上传一次，匹配结果为UMat
+        """
+        if self._opencl and frame_level is not None:
+            try:
+                return self._match_full_umat(template_name, template, frame_level, method)
+            except cv2.error as e:
+                logger.warning(f"OpenCL匹配失败，改用CPU匹配: {str(e)}")
+                self._opencl = False
+        buffer = self._match_buffers.get(template_name)
+        if buffer is not None and buffer.shape == (image.shape[0] - template.shape[0] + 1,
+                                                   image.shape[1] - template.shape[1] + 1):
+            return cv2.matchTemplate(image, template, method, result=buffer)
+        return cv2.matchTemplate(image, template, method)
+
+    def _match_full_umat(self, template_name: str, template: np.ndarray, frame_level: int,
+                         method: int) -> cv2.UMat:
+        """在GPU上匹配当前帧的某一层（图像和模板各自只上传一次）"""
+        frame_umat = self._frame_umats.get(frame_level)
+        if frame_umat is None:
+            frame_umat = self._frame_umats.setdefault(frame_level, cv2.UMat(self._frame_pyramid[frame_level]))
+        template_umat = self._template_umats.get(template_name)
+        if template_umat is None:
+            template_umat = self._template_umats.setdefault(template_name, cv2.UMat(template))
+        return cv2.matchTemplate(frame_umat, template_umat, method)
+
+    @staticmethod
+    def _best_match(result, method: int) -> Tuple[float, Tuple[int, int]]:
+        """取匹配结果中的最佳位置，统一换算成越大越相似的匹配度"""
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        if method == cv2.TM_SQDIFF_NORMED:
+            return 1.0 - min_val, min_loc
+        return max_val, max_loc
+
+    def _pyr_down(self, image: np.ndarray, levels: int) -> np.ndarray:
+        """将图像缩小 2^levels 倍"""
+        for _ in range(levels):
+            image = cv2.pyrDown(image)
+        return image
+
+    def _build_pyramid(self, gray: np.ndarray, levels: int) -> List[np.ndarray]:
+        """生成 [原图, 1/2, ..., 1/2^levels] 的金字塔"""
+        pyramid = [gray]
+        for _ in range(levels):
+            pyramid.append(cv2.pyrDown(pyramid[-1]))
+        return pyramid
+
+    def frame_hash(self, screen: np.ndarray) -> int:
+        """计算帧指纹（基于最小一层的灰度图），用于判断画面是否变化"""
+        self._get_frame_levels(screen)
+        if self._frame_hash is None:
+            self._frame_hash = hash(self._frame_pyramid[-1].tobytes())
+        return self._frame_hash
+
+    def _frame_results(self, screen: np.ndarray) -> Dict[str, Optional[Tuple[int, int]]]:
+        """取当前帧指纹对应的匹配结果缓存，画面相同的帧共用一份结果"""
+        key = self.frame_hash(screen)
+        results = self._match_cache.get(key)
+        if results is None:
+            results = self._match_cache[key] = {}
+            if len(self._match_cache) > self.match_cache_size:
+                self._match_cache.popitem(last=False)
+        else:
+            self._match_cache.move_to_end(key)
+        return results
+
+    def _get_frame_levels(self, screen: np.ndarray) -> List[np.ndarray]:
+        """获取当前帧的灰度金字塔，每帧只转换一次"""
+        if screen is not self._frame_source:
+            self._set_frame_levels(screen, cv2.cvtColor(screen, cv2.COLOR_BGR2GRAY))
+        return self._frame_pyramid
+
+    def _set_frame_levels(self, screen: np.ndarray, gray: np.ndarray):
+        """登记当前帧及其灰度图，并生成金字塔"""
+        frame_h, frame_w = gray.shape[:2]
+        if (frame_w, frame_h) != self.screen_size:
+            self._resize_match_buffers((frame_w, frame_h))
+        self._frame_source = screen
+        self._frame_pyramid = self._build_pyramid(gray, self.pyramid_levels)
+        self._frame_hash = None
+        self._frame_umats = {}
+
     def save_emulator_config(self, devices: List[Tuple[str, str]]):
         """保存模拟器配置"""
         try:
@@ -292,27 +622,91 @@ class AutoClicker:
     def load_emulator_config(self) -> List[Tuple[str, str]]:
         """加载模拟器配置"""
         try:
-            if not os.path.exists(self.emulator_config_file):
-                return []
-                
             with open(self.emulator_config_file, 'r', encoding='utf-8') as f:
                 config = json.load(f)
             
             devices = [(item['device_id'], item['device_info']) for item in config]
             logger.info(f"已加载{len(devices)}个已知模拟器配置")
             return devices
+        except FileNotFoundError:
+            return []
         except Exception as e:
             logger.error(f"加载模拟器配置失败: {str(e)}")
             return []
             
+    def _run_adb(self, *args: str, device_id: Optional[str] = None) -> str:
+        """直接执行ADB（不经过cmd.exe）并返回标准输出"""
+        command = [self.adb_path]
+        if device_id:
+            command += ['-s', device_id]
+        command += args
+        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        return result.stdout
+
+    def _getprops(self, device_id: str) -> Dict[str, str]:
+        """一次getprop调用读取设备的全部属性（硬件属性不会变化，按设备缓存）"""
+        props = self._props_cache.get(device_id)
+        if props is None:
+            output = self._run_adb('shell', 'getprop', device_id=device_id)
+            props = dict(self._GETPROP_RE.findall(output))
+            # 设备离线时读到的是空结果，不缓存，下次重新读取
+            if props:
+                self._props_cache[device_id] = props
+        return props
+
+    def _open_shell(self):
+        """为当前设备启动常驻的adb shell进程"""
+        self.close_shell()
+        self._shell = subprocess.Popen(
+            [self.adb_path, '-s', self.emulator_address, 'shell'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            bufsize=0
+        )
+        self._shell_address = self.emulator_address
+
+    def close_shell(self):
+        """关闭常驻的adb shell进程"""
+        if self._shell is not None:
+            try:
+                self._shell.stdin.close()
+                self._shell.wait(timeout=2)
+            except Exception:
+                self._shell.kill()
+            self._shell = None
+
+    def _shell_command(self, command: str):
+        """通过常驻shell执行命令，shell已退出（如设备断开重连）时重新启动一次"""
+        for attempt in range(2):
+            if (self._shell is None or self._shell.poll() is not None
+                    or self._shell_address != self.emulator_address):
+                self._open_shell()
+            try:
+                self._shell.stdin.write(command.encode('utf-8') + b'\n')
+                return
+            except OSError:
+                self._shell = None
+                if attempt:
+                    raise
+
     def execute_adb_command(self, command: str) -> bool:
         """执行ADB命令并检查结果"""
         try:
-            full_command = f"{self.adb_path} -s {self.emulator_address} {command}"
-            logger.info(f"执行ADB命令: {full_command}")
+            # 点击走常驻shell，避免每次启动adb进程；
+            # 滑动等需要等待执行完毕并检查结果的命令仍单独启动adb进程
+            if command.startswith('shell input tap '):
+                logger.info(f"执行ADB命令: {command}")
+                self._shell_command(command[len('shell '):])
+                return True
+            
+            full_command = [self.adb_path, '-s', self.emulator_address] + command.split()
+            logger.info(f"执行ADB命令: {' '.join(full_command)}")
             
             # 执行命令并获取输出
-            result = os.popen(full_command).read()
+            result = subprocess.run(
+                full_command, capture_output=True, text=True, encoding='utf-8', errors='ignore'
+            ).stdout
             
             # 检查命令是否成功
             if "error" in result.lower() or "failed" in result.lower():
@@ -327,6 +721,9 @@ class AutoClicker:
             
     def get_template_names(self) -> List[str]:
         """获取所有模板图片名称"""
+        if self._template_names_cached is not None:
+            return self._template_names_cached
+
         try:
             # 获取所有png文件
             png_files = glob.glob(os.path.join(self.image_dir, 'button*.png'))
@@ -334,6 +731,7 @@ class AutoClicker:
             template_names = [os.path.splitext(os.path.basename(f))[0] for f in png_files]
             # 按名称排序
             template_names.sort()
+            self._template_names_cached = template_names
             return template_names
         except Exception as e:
             logger.error(f"获取模板图片列表失败: {str(e)}")
@@ -379,14 +777,50 @@ class AutoClicker:
         # 保存更新后的配置
         self.save_button_config()
         
+    def refresh_template_configs(self):
+        """按钮配置变化后调用，丢弃已合并的模板配置和按旧配置得到的匹配结果"""
+        self._cfg.clear()
+        self._scan_orders.clear()
+        self._match_cache.clear()
+
+    def _template_config(self, template_name: str) -> SimpleNamespace:
+        """获取模板配置（按钮配置与默认值合并，每个模板只合并一次）"""
+        cfg = self._cfg.get(template_name)
+        if cfg is None:
+            config = self.button_config.get(template_name, {})
+            cfg = SimpleNamespace(
+                threshold=config.get('threshold', self.threshold),
+                roi=config.get('roi'),
+                click_min=config.get('click_min', self.click_range[0]),
+                click_max=config.get('click_max', self.click_range[1]),
+                delay_min=config.get('delay_min', self.delay_range[0]),
+                delay_max=config.get('delay_max', self.delay_range[1]),
+                priority=config.get('priority', 0),  # 数值越小越优先，相同时按名称顺序
+                # 匹配方法：默认归一化相关系数；纯色背景上的不透明按钮可配置 'sqdiff'（归一化平方差）
+                method=cv2.TM_SQDIFF_NORMED if config.get('method') == 'sqdiff' else cv2.TM_CCOEFF_NORMED
+            )
+            self._cfg[template_name] = cfg
+        return cfg
+
+    def scan_order(self, template_names: List[str]) -> List[str]:
+        """按配置的优先级排列扫描顺序（稳定排序，未配置优先级时保持原顺序）"""
+        key = tuple(template_names)
+        order = self._scan_orders.get(key)
+        if order is None:
+            priorities = np.array([self._template_config(n).priority for n in template_names])
+            order = [template_names[i] for i in np.argsort(priorities, kind='stable')]
+            self._scan_orders[key] = order
+        return order
+
     def load_button_config(self) -> bool:
         """加载按钮配置"""
         try:
-            if os.path.exists(self.button_config_file):
-                with open(self.button_config_file, 'r', encoding='utf-8') as f:
-                    self.button_config = json.load(f)
-                logger.info("已加载按钮配置")
-                return True
+            with open(self.button_config_file, 'r', encoding='utf-8') as f:
+                self.button_config = json.load(f)
+            self.refresh_template_configs()
+            logger.info("已加载按钮配置")
+            return True
+        except FileNotFoundError:
             return False
         except Exception as e:
             logger.error(f"加载按钮配置失败: {str(e)}")
@@ -394,6 +828,7 @@ class AutoClicker:
             
     def save_button_config(self):
         """保存按钮配置"""
+        self.refresh_template_configs()
         try:
             with open(self.button_config_file, 'w', encoding='utf-8') as f:
                 json.dump(self.button_config, f, ensure_ascii=False, indent=4)
@@ -443,14 +878,15 @@ class AutoClicker:
     def get_device_info(self, device: str) -> str:
         """获取设备信息"""
         try:
+            props = self._getprops(device)
             # 获取设备型号
-            model = os.popen(f"{self.adb_path} -s {device} shell getprop ro.product.model").read().strip()
+            model = props.get('ro.product.model', '')
             # 获取设备品牌
-            brand = os.popen(f"{self.adb_path} -s {device} shell getprop ro.product.brand").read().strip()
+            brand = props.get('ro.product.brand', '')
             # 获取设备名称
-            name = os.popen(f"{self.adb_path} -s {device} shell getprop ro.product.name").read().strip()
+            name = props.get('ro.product.name', '')
             # 获取Android版本
-            android_ver = os.popen(f"{self.adb_path} -s {device} shell getprop ro.build.version.release").read().strip()
+            android_ver = props.get('ro.build.version.release', '')
             
             device_info = f"{brand} {model} ({name}) - Android {android_ver}"
             logger.info(f"设备 {device} 的详细信息: {device_info}")
@@ -463,12 +899,12 @@ class AutoClicker:
         """验证设备是否可用"""
         try:
             # 检查设备是否在线
-            result = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.model").read().strip()
+            result = self._run_adb('shell', 'getprop', 'ro.product.model', device_id=device_id).strip()
             if not result:
                 return False
                 
             # 尝试执行一个简单的命令
-            result = os.popen(f"{self.adb_path} -s {device_id} shell echo 'test'").read().strip()
+            result = self._run_adb('shell', 'echo', 'test', device_id=device_id).strip()
             if result != "test":
                 return False
                 
@@ -480,16 +916,17 @@ class AutoClicker:
     def identify_emulator(self, device_id: str) -> str:
         """识别模拟器类型"""
         try:
+            props = self._getprops(device_id)
             # 获取设备型号
-            model = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.model").read().strip()
+            model = props.get('ro.product.model', '')
             # 获取设备品牌
-            brand = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.brand").read().strip()
+            brand = props.get('ro.product.brand', '')
             # 获取设备制造商
-            manufacturer = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.manufacturer").read().strip()
+            manufacturer = props.get('ro.product.manufacturer', '')
             # 获取设备名称
-            name = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.name").read().strip()
+            name = props.get('ro.product.name', '')
             # 获取设备ID
-            device_id_prop = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.device").read().strip()
+            device_id_prop = props.get('ro.product.device', '')
             
             logger.info(f"设备 {device_id} 的详细信息:")
             logger.info(f"型号: {model}")
@@ -522,49 +959,50 @@ class AutoClicker:
     def find_emulator_processes(self) -> List[Tuple[str, str]]:
         """查找运行中的模拟器进程"""
         try:
-            # 定义模拟器进程的特征
-            emulator_patterns = {
-                "MuMu": ["MuMu", "MuMu12", "MuMu12-2"],
-                "LDPlayer": ["LDPlayer", "dnconsole", "dnplayer"],
-                "Xiaomi": ["Xiaomi"],
-                "HUAWEI": ["HUAWEI"],
-                "Samsung": ["Samsung"]
-            }
-            
             found_processes = []
             print("\n正在搜索模拟器进程...")
             
             # 使用tasklist命令获取进程列表
             result = subprocess.check_output(['tasklist', '/v'], encoding='gbk')
             
-            # 遍历进程列表
-            for line in result.split('\n'):
-                # 检查是否是模拟器进程
-                for emulator_type, patterns in emulator_patterns.items():
-                    if any(pattern.lower() in line.lower() for pattern in patterns):
-                        print(f"\n发现{emulator_type}模拟器进程")
-                        print(f"进程信息: {line}")
+            # 在整个输出上一次性查找所有模拟器特征，再定位到所在行
+            seen = set()
+            for match in self._emulator_pattern.finditer(result):
+                line_start = result.rfind('\n', 0, match.start()) + 1
+                line_end = result.find('\n', match.end())
+                if line_end == -1:
+                    line_end = len(result)
+                    
+                emulator_type = self._emulator_type_of[match.group(0).lower()]
+                if (line_start, emulator_type) in seen:
+                    continue
+                seen.add((line_start, emulator_type))
+                line = result[line_start:line_end]
+                
+                print(f"\n发现{emulator_type}模拟器进程")
+                print(f"进程信息: {line}")
+                
+                # 尝试从命令行中提取端口信息
+                port_match = self._PORT_RE.search(line)
+                if port_match:
+                    port = port_match.group(1)
+                    device_id = f"127.0.0.1:{port}"
+                    print(f"找到端口: {port}")
+                    
+                    # 验证设备是否可用
+                    if self.verify_device(device_id):
+                        props = self._getprops(device_id)
+                        model = props.get('ro.product.model', '')
+                        brand = props.get('ro.product.brand', '')
+                        device_info = f"{brand} {model}"
                         
-                        # 尝试从命令行中提取端口信息
-                        port_match = re.search(r'port\s*(\d+)', line)
-                        if port_match:
-                            port = port_match.group(1)
-                            device_id = f"127.0.0.1:{port}"
-                            print(f"找到端口: {port}")
-                            
-                            # 验证设备是否可用
-                            if self.verify_device(device_id):
-                                model = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.model").read().strip()
-                                brand = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.brand").read().strip()
-                                device_info = f"{brand} {model}"
-                                
-                                if any(target in device_info for target in ["HUAWEI ALN-AL10", "Samsung SM-S9110", "Xiaomi 12s"]):
-                                    print(f"验证成功: {device_info}")
-                                    found_processes.append((device_id, device_info))
-                                else:
-                                    print(f"设备信息不匹配: {device_info}")
-                            else:
-                                print(f"设备 {device_id} 验证失败")
+                        if any(target in device_info for target in ["HUAWEI ALN-AL10", "Samsung SM-S9110", "Xiaomi 12s"]):
+                            print(f"验证成功: {device_info}")
+                            found_processes.append((device_id, device_info))
+                        else:
+                            print(f"设备信息不匹配: {device_info}")
+                    else:
+                        print(f"设备 {device_id} 验证失败")
             
             return found_processes
             
@@ -577,11 +1015,9 @@ class AutoClicker:
         try:
             print("\n正在搜索设备...")
             
-            # 重启ADB服务器
-            os.system(f"{self.adb_path} kill-server")
-            time.sleep(1)
-            os.system(f"{self.adb_path} start-server")
-            time.sleep(2)
+            # 启动ADB服务器（已在运行时直接返回，start-server会等服务器就绪后才退出）
+            subprocess.run([self.adb_path, 'start-server'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
             
             devices = []
             
@@ -619,30 +1055,34 @@ class AutoClicker:
                     try:
                         # 解析JSON输出
                         emulators = json.loads(result)
+                        targets = []
                         for index, emu in emulators.items():
                             if emu.get('is_process_started') and emu.get('adb_host_ip') and emu.get('adb_port'):
                                 device_id = f"{emu['adb_host_ip']}:{emu['adb_port']}"
                                 device_info = f"MuMu模拟器12{'-' + index if index != '0' else ''}"
                                 print(f"找到模拟器: {device_info}")
                                 print(f"ADB地址: {device_id}")
+                                targets.append(device_id)
+                        
+                        # 先依次连接所有模拟器（adb connect在连接结束后才返回，无需额外等待）
+                        for device_id in targets:
+                            subprocess.run([self.adb_path, 'connect', device_id],
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+                        
+                        for device_id in targets:
+                            # 检查设备是否可用
+                            props = self._getprops(device_id)
+                            model = props.get('ro.product.model', '')
+                            if model:
+                                brand = props.get('ro.product.brand', '')
+                                device_info = f"{brand} {model}"
+                                print(f"设备信息: {device_info}")
                                 
-                                # 连接到模拟器
-                                os.system(f"{self.adb_path} connect {device_id}")
-                                time.sleep(1)
-                                
-                                # 检查设备是否可用
-                                result = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.model").read().strip()
-                                if result:
-                                    model = result
-                                    brand = os.popen(f"{self.adb_path} -s {device_id} shell getprop ro.product.brand").read().strip()
-                                    device_info = f"{brand} {model}"
-                                    print(f"设备信息: {device_info}")
-                                    
-                                    # 直接添加检测到的设备，不再检查特定型号
-                                    print(f"添加设备: {device_info}")
-                                    devices.append((device_id, device_info))
-                                else:
-                                    print(f"未能获取设备 {device_id} 的信息")
+                                # 直接添加检测到的设备，不再检查特定型号
+                                print(f"添加设备: {device_info}")
+                                devices.append((device_id, device_info))
+                            else:
+                                print(f"未能获取设备 {device_id} 的信息")
                         
                         if devices:
                             print(f"\n通过MuMuManager找到 {len(devices)} 个目标设备")
@@ -655,7 +1095,7 @@ class AutoClicker:
             
             # 显示最终的设备列表
             print("\n连接后的设备列表:")
-            devices_output = os.popen(f"{self.adb_path} devices").read()
+            devices_output = self._run_adb('devices')
             print(devices_output)
             
             if not devices:
@@ -707,12 +1147,12 @@ class AutoClicker:
                 if not self.select_device():
                     return False
                     
-            # 连接设备
-            os.system(f"{self.adb_path} connect {self.emulator_address}")
-            time.sleep(2)
+            # 连接设备（adb connect在连接结束后才返回）
+            subprocess.run([self.adb_path, 'connect', self.emulator_address],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
             
             # 检查设备连接状态
-            result = os.popen(f"{self.adb_path} devices").read()
+            result = self._run_adb('devices')
             if self.emulator_address in result and "device" in result:
                 logger.info(f"成功连接到设备: {self.emulator_address}")
                 return True
@@ -725,98 +1165,210 @@ class AutoClicker:
             
     def get_screen(self) -> Optional[np.ndarray]:
         """获取屏幕截图"""
+        if self._screen_cache is not None and time.monotonic() - self._screen_cache[0] < self.screen_ttl:
+            return self._screen_cache[1]
         try:
-            # 截图并保存
-            if not self.execute_adb_command("shell screencap -p /sdcard/screen.png"):
+            # 通过exec-out直接读取原始帧缓冲，不经过sdcard和本地临时文件
+            proc = subprocess.Popen(
+                [self.adb_path, '-s', self.emulator_address, 'exec-out', 'screencap'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+            raw, _ = proc.communicate()
+            if proc.returncode != 0 or len(raw) < 12:
                 logger.error("截图命令执行失败")
                 return None
-                
-            if not self.execute_adb_command("pull /sdcard/screen.png screen.png"):
-                logger.error("拉取截图失败")
-                return None
-            
-            # 读取截图
-            screen = cv2.imread("screen.png")
+
+            screen = self._decode_raw_screencap(raw)
             if screen is None:
-                logger.error("读取截图失败")
+                # 像素格式不是RGBA_8888时改用PNG截图
+                screen = self._get_screen_png()
+            if screen is None:
+                logger.error("解析截图数据失败")
                 return None
-                
-            # 删除临时文件
-            try:
-                os.remove("screen.png")
-            except:
-                pass
-                
+
+            self._screen_cache = (time.monotonic(), screen)
             return screen
         except Exception as e:
             logger.error(f"获取屏幕截图出错: {str(e)}")
             return None
-            
+
+    def _get_screen_png(self) -> Optional[np.ndarray]:
+        """通过screencap -p获取PNG截图，直接在内存中解码"""
+        proc = subprocess.run(
+            [self.adb_path, '-s', self.emulator_address, 'exec-out', 'screencap', '-p'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=10
+        )
+        if proc.returncode != 0 or not proc.stdout:
+            return None
+        return cv2.imdecode(np.frombuffer(proc.stdout, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def _decode_raw_screencap(self, raw: bytes) -> Optional[np.ndarray]:
+        """解析screencap原始输出（头部 + RGBA像素）为BGR图像"""
+        width, height, pixel_format = struct.unpack_from('<III', raw, 0)
+        # Android 9及以上头部为16字节（多一个colorspace字段），旧版本为12字节
+        header_size = len(raw) - width * height * 4
+        if header_size not in (12, 16) or pixel_format != 1:  # 1: RGBA_8888
+            return None
+
+        rgba = np.frombuffer(raw, dtype=np.uint8, offset=header_size).reshape(height, width, 4)
+        if self._gray_buf is None or self._gray_buf.shape != (height, width):
+            self._screen_buf = np.empty((height, width, 3), dtype=np.uint8)
+            self._gray_buf = np.empty((height, width), dtype=np.uint8)
+        screen = cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR, dst=self._screen_buf)
+        # 匹配只用单通道灰度图，直接从RGBA转换并登记，避免再从BGR转换一次；
+        # 缓冲区内容每帧都会变化，必须在这里重新登记当前帧（清空金字塔和帧指纹）
+        self._set_frame_levels(screen, cv2.cvtColor(rgba, cv2.COLOR_RGBA2GRAY, dst=self._gray_buf))
+        return screen
+
     def find_template(self, template_name: str, screen: np.ndarray) -> Optional[Tuple[int, int]]:
         """查找模板图片位置"""
         try:
-            # 读取模板图片
-            template_path = os.path.join(self.image_dir, f"{template_name}.png")
-            template = cv2.imread(template_path)
-            if template is None:
-                logger.error(f"无法读取模板图片: {template_name}")
-                return None
-                
-            # 获取按钮配置的阈值
-            threshold = self.button_config.get(template_name, {'threshold': self.threshold})['threshold']
-                
-            # 模板匹配
-            result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-            
-            # 获取所有匹配位置
-            locations = np.where(result >= threshold)
-            locations = list(zip(*locations[::-1]))  # 转换为(x, y)格式
-            
-            if not locations:
-                logger.debug(f"未找到匹配的图片: {template_name}, 最大匹配度: {max_val}")
-                return None
-                
-            # 按匹配度排序
-            matches = []
-            for loc in locations:
-                match_val = result[loc[1], loc[0]]
-                matches.append((match_val, loc))
+            results = self._frame_results(screen)
+            if template_name not in results:
+                results[template_name] = self._match_template(template_name, self._frame_pyramid)
+            return results[template_name]
+        except Exception as e:
+            logger.error(f"查找模板图片出错: {str(e)}")
+            return None
             
-            # 按匹配度从高到低排序
-            matches.sort(reverse=True)
+    def match_many(self, screen: np.ndarray, template_names: List[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+        """在同一帧上匹配一组模板，返回 {模板名称: 位置或None}（与传入顺序一致）"""
+        try:
+            # 灰度金字塔、帧指纹和结果缓存由这一帧的所有模板共用
+            results = self._frame_results(screen)
+            pyramid = self._frame_pyramid
+            futures = {
+                template_name: self._scan_pool.submit(self._match_template, template_name, pyramid)
+                for template_name in template_names if template_name not in results
+            }
+            for template_name, future in futures.items():
+                results[template_name] = future.result()
+            return {template_name: results[template_name] for template_name in template_names}
+        except Exception as e:
+            logger.error(f"匹配模板图片出错: {str(e)}")
+            return dict.fromkeys(template_names)
             
-            # 选择匹配度最高的位置
-            best_match = matches[0]
-            h, w = template.shape[:2]
-            center_x = best_match[1][0] + w // 2
-            center_y = best_match[1][1] + h // 2
+    def _clamp_roi(self, template_name: str, roi, frame_shape, h: int, w: int) -> Optional[Tuple[int, int, int, int]]:
+        """把roi裁剪到画面范围内；格式错误或容不下模板时返回None（改为匹配整个屏幕）"""
+        try:
+            x, y, roi_w, roi_h = (int(v) for v in roi)
+        except (TypeError, ValueError):
+            x = y = roi_w = roi_h = 0
+        frame_h, frame_w = frame_shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + roi_w, frame_w), min(y + roi_h, frame_h)
+        if x1 - x0 < w or y1 - y0 < h:
+            if template_name not in self._bad_rois:
+                self._bad_rois.add(template_name)
+                logger.warning(f"模板 {template_name} 的roi配置无效: {roi}，改为匹配整个屏幕")
+            return None
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _match_template(self, template_name: str, pyramid: List[np.ndarray]) -> Optional[Tuple[int, int]]:
+        """在已准备好的灰度金字塔上匹配单个模板"""
+        # 从缓存中读取模板图片
+        template = self._load_template(template_name)
+        if template is None:
+            return None
             
-            logger.info(f"找到图片 {template_name}, 最佳匹配度: {best_match[0]:.2f}")
-            return (center_x, center_y)
+        index = self._tmpl_index[template_name]
+        # 获取按钮配置（阈值、匹配区域、匹配方法）
+        cfg = self._template_config(template_name)
+        threshold = cfg.threshold
+        roi = cfg.roi
+        method = cfg.method
+        # 纯色模板的归一化相关系数在任何位置都是1，匹配结果没有意义
+        if method == cv2.TM_CCOEFF_NORMED and self._tmpl_ssd[index] == 0:
+            return None
+        level = self._template_level[template_name]
+        
+        template_gray = self._tmpl_data[index]
+        h, w = self._tmpl_h[index], self._tmpl_w[index]
+        
+        # 配置了感兴趣区域 roi: [x, y, w, h] 时只在该区域内匹配，否则匹配整个屏幕
+        gray = pyramid[0]
+        if roi:
+            roi = self._clamp_roi(template_name, roi, gray.shape, h, w)
+        if roi:
+            roi_x, roi_y, roi_w, roi_h = roi
+            gray = gray[roi_y:roi_y + roi_h, roi_x:roi_x + roi_w]
+            if level:
+                small = self._pyr_down(gray, level)
+        else:
+            roi_x, roi_y = 0, 0
+            small = pyramid[level]
+        
+        if not level:
+            # 小模板：直接在原分辨率灰度图上匹配
+            x0, y0 = 0, 0
+            result = self._match_full(template_name, gray, template_gray, None if roi else 0, method)
+        else:
+            # 粗匹配：在缩小的灰度图上定位候选位置
+            coarse = self._match_full(template_name, small, self._template_small[template_name],
+                                      None if roi else level, method)
+            coarse_val, coarse_loc = self._best_match(coarse, method)
+            if coarse_val < threshold - self.pyramid_margin:
+                logger.debug(f"未找到匹配的图片: {template_name}, 粗匹配度: {coarse_val}")
+                return None
             
-        except Exception as e:
-            logger.error(f"查找模板图片出错: {str(e)}")
+            # 精匹配：在原分辨率的候选区域内重新匹配
+            scale = 1 << level
+            x0 = max(coarse_loc[0] * scale - scale, 0)
+            y0 = max(coarse_loc[1] * scale - scale, 0)
+            x1 = min(coarse_loc[0] * scale + w + scale, gray.shape[1])
+            y1 = min(coarse_loc[1] * scale + h + scale, gray.shape[0])
+            result = cv2.matchTemplate(gray[y0:y1, x0:x1], template_gray, method)
+        # 只需要匹配度最高的位置，minMaxLoc一次遍历即可得到
+        max_val, max_loc = self._best_match(result, method)
+        if max_val < threshold:
+            logger.debug(f"未找到匹配的图片: {template_name}, 最大匹配度: {max_val}")
             return None
+        
+        center_x = roi_x + x0 + max_loc[0] + w // 2
+        center_y = roi_y + y0 + max_loc[1] + h // 2
+        
+        logger.info(f"找到图片 {template_name}, 最佳匹配度: {max_val:.2f}")
+        return (center_x, center_y)
             
+    def _rand_unit(self) -> float:
+        """从随机数池中取一个[0, 1)的随机数"""
+        if self._rand_index >= self._rand_pool_size:
+            self._rand_pool = self._rng.random(self._rand_pool_size)
+            self._rand_index = 0
+        value = self._rand_pool[self._rand_index]
+        self._rand_index += 1
+        return float(value)
+
+    def _rand_uniform(self, low: float, high: float) -> float:
+        """等价于random.uniform(low, high)"""
+        return low + (high - low) * self._rand_unit()
+
+    def _rand_int(self, low: int, high: int) -> int:
+        """等价于random.randint(low, high)，包含两端"""
+        return low + int((high - low + 1) * self._rand_unit())
+
     def random_click(self, x: int, y: int, template_name: str) -> bool:
         """随机偏移点击"""
         try:
             # 获取图片配置
-            config = self.button_config.get(template_name, {})
-            click_min = config.get('click_min', self.click_range[0])
-            click_max = config.get('click_max', self.click_range[1])
+            cfg = self._template_config(template_name)
             
             # 计算随机偏移
-            offset = random.randint(click_min, click_max)
-            angle = random.uniform(0, 2 * np.pi)
-            offset_x = int(offset * np.cos(angle))
-            offset_y = int(offset * np.sin(angle))
+            offset = self._rand_int(cfg.click_min, cfg.click_max)
+            cos_a, sin_a = self.OFFSET_LUT[self._rand_int(0, 255)]
+            offset_x = int(offset * cos_a)
+            offset_y = int(offset * sin_a)
             
             # 执行点击
             click_x = x + offset_x
             click_y = y + offset_y
             
+            # 点击后画面会变化，之前的截图和匹配结果作废
+            self._screen_cache = None
+            self._match_cache.clear()
             # 使用新的ADB命令执行方法
             if not self.execute_adb_command(f"shell input tap {click_x} {click_y}"):
                 logger.error(f"点击操作失败: ({click_x}, {click_y})")
@@ -831,11 +1383,9 @@ class AutoClicker:
     def random_delay(self, template_name: str):
         """随机延迟"""
         # 获取图片配置
-        config = self.button_config.get(template_name, {})
-        delay_min = config.get('delay_min', self.delay_range[0])
-        delay_max = config.get('delay_max', self.delay_range[1])
+        cfg = self._template_config(template_name)
         
-        delay = random.uniform(delay_min, delay_max)
+        delay = self._rand_uniform(cfg.delay_min, cfg.delay_max)
         logger.info(f"等待 {delay:.2f} 秒")
         time.sleep(delay)
         
@@ -845,24 +1395,27 @@ class AutoClicker:
             # 最多尝试两次
             for attempt in range(2):
                 # 计算滑动距离（向上滑动）
-                scroll_distance = random.randint(500, 800)  # 随机滑动500-800像素
+                scroll_distance = self._rand_int(500, 800)  # 随机滑动500-800像素
                 # 计算终点坐标
                 end_x = x
                 end_y = y - scroll_distance  # 向上滑动，所以是减号
                 
                 # 随机滑动时间（3-6秒）
-                swipe_time = random.randint(3000, 6000)
+                swipe_time = self._rand_int(3000, 6000)
                 
                 # 执行滑动
                 logger.info(f"开始向上滑动: 从({x}, {y})到({end_x}, {end_y}), 滑动时间: {swipe_time/1000:.1f}秒")
                 
+                # 滑动后画面会变化，之前的截图和匹配结果作废
+                self._screen_cache = None
+                self._match_cache.clear()
                 # 使用新的ADB命令执行方法
                 if not self.execute_adb_command(f"shell input touchscreen swipe {x} {y} {end_x} {end_y} {swipe_time}"):
                     logger.error("滑动命令执行失败")
                     continue
                 
                 # 随机等待5-6秒
-                delay = random.uniform(5, 6)
+                delay = self._rand_uniform(5, 6)
                 logger.info(f"滑动完成，等待 {delay:.2f} 秒")
                 time.sleep(delay)
                 
@@ -891,7 +1444,7 @@ class AutoClicker:
         """从文本中提取数字"""
         try:
             # 移除所有非数字字符
-            number = ''.join(filter(str.isdigit, text))
+            number = ''.join(self._DIGITS_RE.findall(text))
             if number:
                 return int(number)
             return None
@@ -1098,17 +1651,32 @@ def main():
         print(f"\n程序开始运行时间: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
         print(f"预计结束时间: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
         
+        # 后台线程阻塞读取按键放入队列，主循环不再轮询键盘
+        key_queue = Queue()
+        
+        def read_keys():
+            while not stop_event.is_set():
+                key_queue.put(msvcrt.getwch())
+        
+        threading.Thread(target=read_keys, name="KeyReader", daemon=True).start()
+        
         while not stop_event.is_set():
             # 检查是否已达到预定运行时间
-            current_time = datetime.now()
-            if current_time >= end_time:
+            remaining = (end_time - datetime.now()).total_seconds()
+            if remaining <= 0:
                 print(f"\n已达到预定运行时间 {run_duration} 分钟，正在停止所有设备...")
                 stop_event.set()
                 break
                 
-            if msvcrt.kbhit():
+            # 最多等待1秒，以便及时发现设备线程设置的停止事件
+            try:
+                key = key_queue.get(timeout=min(1.0, remaining))
+            except Empty:
+                continue
+            
+            if key:
                 try:
-                    key = msvcrt.getch().decode('utf-8').lower()
+                    key = key.lower()
                     
                     if key == 'q':  # 暂停/继续所有
                         all_paused = all(event.is_set() for event in pause_events.values())
@@ -1141,8 +1709,6 @@ def main():
                                 
                 except Exception as e:
                     print(f"处理按键时出错: {str(e)}")
-                    
-            time.sleep(0.1)
             
     except KeyboardInterrupt:
         print("\n正在停止所有设备...")
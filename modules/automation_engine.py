@@ -4,15 +4,74 @@
 """
 
 import os
+import sys
 import time
+import queue
+import random
 import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from array import array
 from typing import Dict, List, Tuple, Optional, Any
 from datetime import datetime, timedelta
 from modules.core import ConfigManager, DeviceManager, ImageProcessor, InputController
 
 logger = logging.getLogger("AutomationEngine")
 
+# 设备日志文件处理器，按日志文件路径复用，重复运行时不会重复打开文件
+_HANDLER_CACHE: Dict[str, logging.Handler] = {}
+
+# 键盘输入：Windows使用msvcrt，其他平台通过selectors检查标准输入（按回车后生效）
+if os.name == 'nt':
+    import msvcrt
+    _kbhit, _getch = msvcrt.kbhit, msvcrt.getwch
+else:
+    import selectors
+    _stdin_selector = selectors.DefaultSelector()
+    try:
+        _stdin_selector.register(sys.stdin, selectors.EVENT_READ)
+    except (ValueError, OSError):  # 标准输入不可用（例如被重定向关闭）
+        pass
+        
+    def _kbhit() -> bool:
+        return bool(_stdin_selector.get_map()) and bool(_stdin_selector.select(timeout=0))
+        
+    def _getch() -> str:
+        return sys.stdin.read(1)
+
+class PauseFlag:
+    """
+    设备暂停标志，接口与threading.Event的is_set/set/clear一致
+    所有设备的标志存放在同一个字节数组中，读取时不加锁；
+    继续运行时通过条件变量唤醒正在等待的设备线程
+    """
+    
+    def __init__(self, flags: Optional[array] = None, index: int = 0,
+                 condition: Optional[threading.Condition] = None):
+        self._flags = flags if flags is not None else array('B', [0])
+        self._index = index
+        self._condition = condition if condition is not None else threading.Condition()
+        
+    def is_set(self) -> bool:
+        """是否处于暂停状态（单字节读取，不加锁）"""
+        return self._flags[self._index] != 0
+        
+    def set(self) -> None:
+        """暂停"""
+        self._flags[self._index] = 1
+        
+    def clear(self) -> None:
+        """继续运行，并唤醒等待中的线程"""
+        with self._condition:
+            self._flags[self._index] = 0
+            self._condition.notify_all()
+            
+    def wait_cleared(self, timeout: float) -> bool:
+        """暂停时最多等待timeout秒，继续运行时立即返回；返回是否已继续运行"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._flags[self._index], timeout)
+
 class AutomationModule:
     """自动化模块基类，所有具体的自动化模块都应该继承这个类"""
     
@@ -30,6 +89,12 @@ class AutomationModule:
         self.module_name = module_config.get("module_name", "未命名模块")
         self.template_sets = module_config.get("template_sets", [])
         self.special_logic = module_config.get("special_logic", {})
+        # 特殊按钮的点击后延迟 (最小值, 范围)，预先计算
+        self._delays = {
+            name: (min(cfg["delay_after"]), max(cfg["delay_after"]) - min(cfg["delay_after"]))
+            for name, cfg in module_config.get("special_buttons", {}).items()
+            if "delay_after" in cfg
+        }
         
         # 运行状态
         self.is_running = False
@@ -59,13 +124,10 @@ class AutomationModule:
             
             # 特殊按钮处理
             if button_name in self.module_config.get("special_buttons", {}):
-                special_config = self.module_config["special_buttons"][button_name]
-                
                 # 特殊延迟
-                if "delay_after" in special_config:
-                    delay_range = special_config["delay_after"]
-                    delay = min(delay_range) + random.random() * (max(delay_range) - min(delay_range))
-                    time.sleep(delay)
+                if button_name in self._delays:
+                    low, span = self._delays[button_name]
+                    time.sleep(low + random.random() * span)
             else:
                 # 普通延迟
                 self.input_controller.random_delay(button_name)
@@ -82,44 +144,64 @@ class AutomationModule:
             self.total_runs += 1
             logger.info(f"完成一次运行，总计: {self.total_runs}")
             
-class DeviceThread(threading.Thread):
-    """设备线程类，管理单个设备的自动化"""
+class DeviceThread:
+    """
+    设备任务类，管理单个设备的自动化
+    由引擎的共享线程池按step()逐次调度；也可以直接调用run()在当前线程中运行
+    """
     
     def __init__(self, 
                  device_id: str, 
                  device_info: str, 
                  automation_module: AutomationModule,
                  stop_event: threading.Event,
-                 run_duration: int):
-        super().__init__(name=f"Device-{device_id}")
+                 run_duration: int,
+                 log_queue: Optional[queue.Queue] = None):
         self.device_id = device_id
         self.device_info = device_info
         self.automation_module = automation_module
         self.stop_event = stop_event
-        self.pause_event = threading.Event()
+        self.pause_event = PauseFlag()
         self.start_time = None
         self.run_duration = run_duration  # 运行时长（分钟）
+        self.finished = threading.Event()
+        self._end_mono = 0.0
+        self._next_log_mono = 0.0
         
         # 设置设备特有的日志
+        self.log_queue = log_queue
+        self.log_handler = None  # 写入设备日志文件的处理器
+        self._logger_handler = None  # 挂在设备logger上的处理器，结束时移除
         self.logger = logging.getLogger(f"Device-{device_id}")
         self.setup_logging()
         
     def setup_logging(self) -> None:
         """为设备设置专用日志"""
+        # logs目录由AutomationEngine初始化时创建
         log_dir = "logs"
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-            
         log_file = os.path.join(log_dir, f"device_{self.device_id.replace(':', '_')}.log")
-        handler = logging.FileHandler(log_file)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
+        handler = _HANDLER_CACHE.get(log_file)
+        if handler is None:
+            handler = logging.FileHandler(log_file)
+            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            # 所有设备共用一个日志队列，文件处理器只接收本设备的日志
+            handler.addFilter(logging.Filter(self.logger.name))
+            _HANDLER_CACHE[log_file] = handler
+        self.log_handler = handler
         
-        self.logger.addHandler(handler)
+        if self._logger_handler is not None:
+            self.logger.removeHandler(self._logger_handler)
+        if self.log_queue is not None:
+            # 设备线程只把日志放入队列，文件写入由引擎的QueueListener统一完成
+            self._logger_handler = QueueHandler(self.log_queue)
+        else:
+            self._logger_handler = handler
+        self.logger.addHandler(self._logger_handler)
         self.logger.setLevel(logging.INFO)
         
-    def run(self) -> None:
-        """线程运行函数"""
+    def start_run(self) -> bool:
+        """开始运行：记录时间并初始化模块，失败时直接结束"""
         try:
             self.start_time = datetime.now()
             end_time = self.start_time + timedelta(minutes=self.run_duration)
@@ -128,62 +210,99 @@ class DeviceThread(threading.Thread):
             self.logger.info(f"计划运行时间: {self.run_duration} 分钟")
             self.logger.info(f"预计结束时间: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
             
+            # 循环内只用单调时钟计时，datetime仅用于日志显示
+            self._end_mono = time.monotonic() + self.run_duration * 60
+            # 剩余时间每到10分钟的整数倍时显示一次
+            self._next_log_mono = self._end_mono - ((self.run_duration - 1) // 10) * 600
+            
             # 初始化模块
-            if not self.automation_module.initialize():
-                self.logger.error(f"模块初始化失败: {self.automation_module.module_name}")
-                return
+            if self.automation_module.initialize():
+                return True
+            self.logger.error(f"模块初始化失败: {self.automation_module.module_name}")
+        except Exception as e:
+            self.logger.error(f"设备 {self.device_info} 线程运行出错: {str(e)}")
+        self.finish()
+        return False
+        
+    def step(self) -> bool:
+        """运行一步（一次run_once或一次暂停等待），返回是否需要继续运行"""
+        try:
+            if self.stop_event.is_set():
+                return False
                 
-            while not self.stop_event.is_set():
-                current_time = datetime.now()
-                # 强制检查运行时间，确保不会超过设定时间
-                if current_time >= end_time:
-                    self.logger.info(f"设备 {self.device_info} 已达到预定运行时间，停止运行")
-                    self.stop_event.set()
-                    break
-                    
-                remaining_minutes = (end_time - current_time).total_seconds() / 60
-                if int(remaining_minutes) % 10 == 0 and int(remaining_minutes) > 0:  # 每10分钟显示一次剩余时间
-                    self.logger.info(f"设备 {self.device_info} 剩余运行时间: {int(remaining_minutes)} 分钟")
+            now = time.monotonic()
+            # 强制检查运行时间，确保不会超过设定时间
+            if now >= self._end_mono:
+                self.logger.info(f"设备 {self.device_info} 已达到预定运行时间，停止运行")
+                self.stop_event.set()
+                return False
                 
-                # 检查是否需要暂停
-                if self.pause_event.is_set():
-                    time.sleep(1)
-                    continue
-                    
-                # 运行一次自动化流程
-                start_run = datetime.now()
-                # 设置最大执行时间限制
-                max_run_time = 5  # 最长5秒
+            if now >= self._next_log_mono:
+                self.logger.info(f"设备 {self.device_info} 剩余运行时间: {round((self._end_mono - now) / 60)} 分钟")
+                self._next_log_mono += 600
+            
+            # 检查是否需要暂停（继续运行时立即被唤醒）
+            if self.pause_event.is_set():
+                self.pause_event.wait_cleared(1)
+                return True
                 
-                try:
-                    self.automation_module.run_once(self.stop_event, self.pause_event)
-                    
-                    # 如果运行时间过长，添加日志记录
-                    run_time = (datetime.now() - start_run).total_seconds()
-                    if run_time > max_run_time:
-                        self.logger.warning(f"设备 {self.device_info} 单次运行耗时 {run_time:.2f} 秒，可能影响时间控制")
-                        
-                except Exception as e:
-                    self.logger.error(f"设备 {self.device_info} 运行出错: {str(e)}")
-                    time.sleep(1)
+            # 运行一次自动化流程
+            start_run = time.monotonic()
+            # 设置最大执行时间限制
+            max_run_time = 5  # 最长5秒
+            
+            try:
+                self.automation_module.run_once(self.stop_event, self.pause_event)
                 
+                # 如果运行时间过长，添加日志记录
+                run_time = time.monotonic() - start_run
+                if run_time > max_run_time:
+                    self.logger.warning(f"设备 {self.device_info} 单次运行耗时 {run_time:.2f} 秒，可能影响时间控制")
+                    
+            except Exception as e:
+                self.logger.error(f"设备 {self.device_info} 运行出错: {str(e)}")
+                time.sleep(1)
+            return True
+            
         except Exception as e:
             self.logger.error(f"设备 {self.device_info} 线程运行出错: {str(e)}")
-        finally:
-            # 清理模块资源
-            try:
-                self.automation_module.cleanup()
-            except Exception as e:
-                self.logger.error(f"清理模块资源出错: {str(e)}")
-                
+            return False
+            
+    def finish(self) -> None:
+        """结束运行：清理模块资源并记录实际运行时间"""
+        try:
+            self.automation_module.cleanup()
+        except Exception as e:
+            self.logger.error(f"清理模块资源出错: {str(e)}")
+            
+        if self.start_time is not None:
             run_time = datetime.now() - self.start_time
             hours = run_time.total_seconds() / 3600
             self.logger.info(f"设备 {self.device_info} 实际运行时间: {hours:.2f} 小时")
+            
+        # 移除本次运行挂上的处理器，下次运行同一设备时不会重复输出
+        self.logger.removeHandler(self._logger_handler)
+        self.finished.set()
+        
+    def run(self) -> None:
+        """在当前线程中运行直到结束"""
+        if not self.start_run():
+            return
+        while self.step():
+            pass
+        self.finish()
+        
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """等待设备运行结束"""
+        return self.finished.wait(timeout)
 
 class AutomationEngine:
     """自动化引擎，负责协调所有模块和设备"""
     
     def __init__(self, config_path: str = "config/settings.json"):
+        # 设备日志目录只需创建一次
+        os.makedirs("logs", exist_ok=True)
+        
         # 初始化核心组件
         self.config = ConfigManager(config_path)
         self.device_manager = DeviceManager(self.config)
@@ -194,8 +313,22 @@ class AutomationEngine:
         # 运行状态
         self.stop_event = threading.Event()
         self.pause_events = {}
+        # 所有设备的暂停标志（每个设备一个字节）和唤醒用的条件变量
+        self._pause_flags = array('B')
+        self._pause_cv = threading.Condition()
         self.threads = []
+        self._thread_by_id = {}  # device_id -> DeviceThread
+        # 所有设备共用的线程池，每个设备同一时间只有一个待执行的step
+        self._executor = None
         self.selected_devices = []
+        # 键盘输入由后台线程阻塞读取后放入队列
+        self._key_queue = queue.Queue()
+        # 设备日志队列，由后台QueueListener统一写入各设备的日志文件
+        self._log_queue = queue.Queue(-1)
+        self._log_listener = None
+        # 所有设备共用的图像处理器和输入控制器（设备由device_manager决定），首次加载模块时创建
+        self._shared_image_processor = None
+        self._shared_input_controller = None
         
     def register_module(self, module_id: str, module_class) -> None:
         """注册模块"""
@@ -213,9 +346,13 @@ class AutomationEngine:
             logger.error(f"未找到模块配置: {module_id}")
             return None
             
-        # 为设备设置核心组件
-        image_processor = ImageProcessor(self.config, self.device_manager)
-        input_controller = InputController(self.device_manager, self.config)
+        # 核心组件在设备间共用，已加载的模板缓存不会因切换设备而丢失
+        if self._shared_image_processor is None:
+            self._shared_image_processor = ImageProcessor(self.config, self.device_manager)
+        if self._shared_input_controller is None:
+            self._shared_input_controller = InputController(self.device_manager, self.config)
+        image_processor = self._shared_image_processor
+        input_controller = self._shared_input_controller
         
         # 创建模块实例
         try:
@@ -331,13 +468,23 @@ class AutomationEngine:
                 
             # 创建控制事件
             self.stop_event.clear()
-            self.pause_events = {device_id: threading.Event() for device_id, _ in self.selected_devices}
+            self._pause_flags = array('B', bytes(len(self.selected_devices)))
+            self.pause_events = {
+                device_id: PauseFlag(self._pause_flags, index, self._pause_cv)
+                for index, (device_id, _) in enumerate(self.selected_devices)
+            }
             
             # 创建并启动线程
             self.threads = []
+            self._thread_by_id = {}
+            self._executor = ThreadPoolExecutor(
+                max_workers=min(len(self.selected_devices), os.cpu_count() or 1),
+                thread_name_prefix="Device"
+            )
+            device_by_id = {d[0]: d for d in self.device_manager.devices}
             for device_id, device_info in self.selected_devices:
-                # 为每个设备设置当前设备
-                self.device_manager.select_device(next(i for i, d in enumerate(self.device_manager.devices) if d[0] == device_id))
+                # 为每个设备设置当前设备（设备来自list_devices，无需再次校验索引）
+                self.device_manager.active_device = device_by_id[device_id]
                 
                 # 加载模块
                 module = self.load_module(module_id, device_id)
@@ -351,15 +498,25 @@ class AutomationEngine:
                     device_info, 
                     module,
                     self.stop_event, 
-                    run_duration
+                    run_duration,
+                    self._log_queue
                 )
                 thread.pause_event = self.pause_events[device_id]
                 
-                # 启动线程
+                # 提交到线程池运行
                 self.threads.append(thread)
-                thread.start()
+                self._thread_by_id[device_id] = thread
+                self._executor.submit(self._device_work, thread, True)
                 print(f"已启动设备 {device_info} 的线程")
                 
+            # 启动日志监听线程（线程启动后产生的日志已在队列中等待）
+            self._log_listener = QueueListener(
+                self._log_queue,
+                *(thread.log_handler for thread in self.threads),
+                respect_handler_level=True
+            )
+            self._log_listener.start()
+                
             # 显示控制面板
             self.show_control_panel()
             
@@ -369,73 +526,126 @@ class AutomationEngine:
             print(f"\n程序开始运行时间: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
             print(f"预计结束时间: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
             
+            self._start_key_reader()
             while not self.stop_event.is_set():
                 # 检查是否已达到预定运行时间
-                current_time = datetime.now()
-                if current_time >= end_time:
+                remaining = (end_time - datetime.now()).total_seconds()
+                if remaining <= 0:
                     print(f"\n已达到预定运行时间 {run_duration} 分钟，正在停止所有设备...")
                     self.stop_event.set()
                     break
                     
-                # 处理用户输入
-                self.handle_user_input()
-                time.sleep(0.1)
+                # 等待用户输入，最多等待1秒以便及时发现设备线程设置的停止事件
+                try:
+                    key = self._key_queue.get(timeout=min(1.0, remaining))
+                except queue.Empty:
+                    continue
+                self._dispatch_key(key)
                 
         except KeyboardInterrupt:
             print("\n正在停止所有设备...")
             self.stop_event.set()
             
         finally:
-            # 等待所有线程结束
+            # 等待所有设备结束
             for thread in self.threads:
                 thread.join()
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            self.device_manager.close_shells()
+            # 写完队列中剩余的日志后关闭文件（处理器保留在缓存中，下次写入时重新打开）
+            if self._log_listener is not None:
+                self._log_listener.stop()
+                for handler in self._log_listener.handlers:
+                    handler.close()
+                self._log_listener = None
             print("\n所有设备已停止运行")
             
+    def _device_work(self, thread: DeviceThread, first: bool = False) -> None:
+        """
+        线程池任务：运行设备的一步，需要继续时重新提交自己
+        设备数多于工作线程时各设备按run_once轮流执行
+        """
+        try:
+            if first and not thread.start_run():
+                return
+            if thread.step():
+                self._executor.submit(self._device_work, thread)
+                return
+        except Exception as e:
+            thread.logger.error(f"设备 {thread.device_info} 调度出错: {str(e)}")
+        thread.finish()
+        
     def show_control_panel(self) -> None:
         """显示控制面板"""
         os.system('cls' if os.name == 'nt' else 'clear')
-        print("\n" + "="*50)
-        print("命令控制面板:")
-        print("- 按 'q' 暂停/继续所有设备")
-        print("- 按 'r' 刷新状态")
-        print("- 按 's' 停止所有设备")
-        print("- 按 'd' 切换设备（多设备下有效）")
-        print("\n当前运行的设备:")
+        # 整个面板拼成一个字符串，一次写入stdout
+        out = [
+            "\n" + "="*50,
+            "命令控制面板:",
+            "- 按 'q' 暂停/继续所有设备",
+            "- 按 'r' 刷新状态",
+            "- 按 's' 停止所有设备",
+            "- 按 'd' 切换设备（多设备下有效）",
+            "\n当前运行的设备:",
+        ]
         
+        now = datetime.now()
         for i, (device_id, info) in enumerate(self.selected_devices, 1):
             status = "暂停中" if self.pause_events[device_id].is_set() else "运行中"
-            thread = next((t for t in self.threads if getattr(t, "device_id", None) == device_id), None)
+            thread = self._thread_by_id.get(device_id)
             
             if thread and thread.start_time:
-                elapsed_time = datetime.now() - thread.start_time
+                elapsed_time = now - thread.start_time
                 remaining_time = timedelta(minutes=thread.run_duration) - elapsed_time
                 remaining_minutes = max(0, remaining_time.total_seconds() / 60)
                 
-                print(f"{i}. {info} [{status}]")
-                print(f"   已运行: {elapsed_time.total_seconds()/60:.1f} 分钟")
-                print(f"   剩余: {remaining_minutes:.1f} 分钟")
+                out.append(f"{i}. {info} [{status}]")
+                out.append(f"   已运行: {elapsed_time.total_seconds()/60:.1f} 分钟")
+                out.append(f"   剩余: {remaining_minutes:.1f} 分钟")
                 
-            print(f"   按 {i} 暂停/继续此设备")
+            out.append(f"   按 {i} 暂停/继续此设备")
             
-        print("="*50)
+        out.append("="*50)
+        sys.stdout.write("\n".join(out) + "\n")
+        sys.stdout.flush()
         
-    def handle_user_input(self) -> None:
-        """处理用户输入"""
-        import msvcrt
+    def _start_key_reader(self) -> None:
+        """启动后台按键读取线程"""
+        threading.Thread(target=self._read_keys, name="KeyReader", daemon=True).start()
         
-        if msvcrt.kbhit():
+    def _read_keys(self) -> None:
+        """阻塞读取按键并放入队列"""
+        while not self.stop_event.is_set():
+            key = _getch()
+            if not key:  # 标准输入已关闭
+                break
+            self._key_queue.put(key)
+            
+    def handle_user_input(self) -> None:
+        """处理用户输入（非阻塞检查一次键盘）"""
+        if _kbhit():
+            self._dispatch_key(_getch())
+            
+    def _dispatch_key(self, key: str) -> None:
+        """处理一个按键"""
+        if key:
             try:
-                key = msvcrt.getch().decode('utf-8').lower()
+                key = key.lower()
                 
                 if key == 'q':  # 暂停/继续所有
                     all_paused = all(event.is_set() for event in self.pause_events.values())
+                    out = []
                     for device_id, device_info in self.selected_devices:
                         if all_paused:
                             self.pause_events[device_id].clear()
-                            print(f"\n继续设备: {device_info}")
+                            out.append(f"\n继续设备: {device_info}")
                         else:
                             self.pause_events[device_id].set()
-                            print(f"\n暂停设备: {device_info}")
+                            out.append(f"\n暂停设备: {device_info}")
+                    sys.stdout.write("\n".join(out) + "\n")
+                    sys.stdout.flush()
                             
                 elif key == 's':  # 停止所有
                     print("\n正在停止所有设备...")
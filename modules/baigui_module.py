@@ -44,20 +44,55 @@ class BaiguiModule(AutomationModule):
         """初始化模块"""
         logger.info(f"初始化百鬼夜行模块")
         # 可以在这里加载百鬼夜行特有的资源
+        # 缓存run_once中用到的配置，避免每次调用都按路径查找
+        self._max_run_time = self.config.get("device_management.max_single_run_time", 5)  # 最长5秒
+        self._random_click_prob = 0.2  # 没有按钮时随机点击的概率
+        self._wait_min, self._wait_span = 1.0, 1.0  # 点击开始按钮后等待结算1~2秒
+        # 屏幕尺寸及中间随机点击区域，分辨率变化时才重新计算
+        self._screen_size = None
+        self._click_rect = None
+        self._detect = self.image_processor.detect_all_buttons_batched
+        # 按钮名到处理函数的映射，未列出的按钮使用默认处理
+        self._button_handlers = {
+            "button1": self._handle_entry,
+            "button2": self._handle_start,
+            "button3": self._handle_settlement,
+        }
+        # 按钮流程 button1 → button2 → button3 → button1：
+        # 根据上一次点击的按钮只匹配预期的下一个按钮，连续若干次未命中再全量扫描
+        self._next_templates = {
+            "button1": ["button2"],
+            "button2": ["button3"],
+            "button3": ["button1"],
+        }
+        # 模板按尺寸预先分组，每帧按组批量匹配
+        group = self.image_processor.group_templates
+        self._template_groups = group(self.template_sets)
+        self._next_groups = {name: group(names) for name, names in self._next_templates.items()}
+        # 可选：上一次点击的按钮 -> 下一个按钮所在区域 [x, y, w, h]
+        self._next_rois = self.module_config.get("next_rois", {})
+        self._narrow_miss_limit = 3
+        self._narrow_misses = 0
+        # 上一次全量扫描没有任何按钮的画面哈希，画面未变化时跳过模板匹配
+        self._empty_frame_hash = None
+        # 点击开始按钮后等待结算的截止时间（单调时钟）
+        self._await_until = 0.0
         return True
         
     def run_once(self, stop_event: threading.Event, pause_event: threading.Event) -> bool:
         """运行一次百鬼夜行自动化流程"""
         # 添加最大执行时间限制
-        max_run_time = self.config.get("device_management.max_single_run_time", 5)  # 最长5秒
-        start_time = time.time()
+        max_run_time = self._max_run_time
+        start_time = time.monotonic()
         
         try:
-            # 检查是否需要暂停
-            if pause_event.is_set():
-                time.sleep(1)
+            # 暂停由DeviceThread.run统一处理，进入这里时设备未暂停
+            # 点击开始按钮后的等待时间内不截图，分段等待以便及时响应暂停和停止
+            remaining = self._await_until - time.monotonic()
+            if remaining > 0:
+                time.sleep(min(remaining, 0.2))
                 return False
-            
+                
             # 多设备支持：检查是否需要切换设备
             if self.device_manager.should_switch_device():
                 logger.info(f"切换到下一个设备")
@@ -76,11 +111,28 @@ class BaiguiModule(AutomationModule):
             self.consecutive_errors = 0  # 重置错误计数
             
             # 检查是否超过最大执行时间
-            if time.time() - start_time > max_run_time:
+            if time.monotonic() - start_time > max_run_time:
                 return False  # 超过最大执行时间，退出本次run调用
             
-            # 检测屏幕上的所有按钮
-            buttons = self.image_processor.detect_all_buttons(screen, self.template_sets)
+            # 画面与上次全量扫描无结果时相同，结果必然相同，跳过匹配（仍可随机点击）
+            frame_hash = hash(screen[::16, ::16].tobytes())
+            expected = self._next_groups.get(self.last_button_clicked)
+            if frame_hash == self._empty_frame_hash:
+                full_scan = True
+                buttons = []
+            # 优先只检测预期的下一个按钮，连续未命中后再检测所有按钮
+            elif expected is None or self._narrow_misses >= self._narrow_miss_limit:
+                full_scan = True
+                self._narrow_misses = 0
+                buttons = self._detect(screen, self._template_groups, first_only=True)
+                self._empty_frame_hash = None if buttons else frame_hash
+            else:
+                full_scan = False
+                buttons = self._detect(screen, expected, self._next_rois.get(self.last_button_clicked), first_only=True)
+                if buttons:
+                    self._narrow_misses = 0
+                else:
+                    self._narrow_misses += 1
             
             # 如果找到了按钮，点击优先级最高的
             if buttons:
@@ -88,56 +140,16 @@ class BaiguiModule(AutomationModule):
                 button_name = button["name"]
                 button_pos = button["position"]
                 
-                # 特殊处理不同按钮
-                if button_name == "button1":  # 进入按钮
-                    logger.info(f"检测到进入按钮")
-                    if self.click_button(button_name, button_pos[0], button_pos[1]):
-                        return True
-                        
-                elif button_name == "button2":  # 开始按钮
-                    logger.info(f"检测到开始按钮")
-                    if self.click_button(button_name, button_pos[0], button_pos[1]):
-                        # 等待一段时间后检查结算按钮
-                        wait_time = random.uniform(1, 2)
-                        # 检查是否会超时
-                        if time.time() - start_time + wait_time > max_run_time:
-                            return True  # 等待会导致超时，所以直接返回
-                        time.sleep(wait_time)
-                        
-                        # 获取新的屏幕截图
-                        screen = self.image_processor.get_screen()
-                        if screen is not None:
-                            button3_pos = self.image_processor.find_template("button3", screen)
-                            if button3_pos:
-                                logger.info(f"检测到结算按钮")
-                                self.click_button("button3", button3_pos[0], button3_pos[1])
-                        return True
-                        
-                elif button_name == "button3":  # 结算按钮
-                    logger.info(f"检测到结算按钮")
-                    if self.click_button(button_name, button_pos[0], button_pos[1]):
-                        return True
-                        
-                else:  # 其他按钮
-                    if self.click_button(button_name, button_pos[0], button_pos[1]):
-                        return True
+                handler = self._button_handlers.get(button_name, self._handle_default)
+                if handler(button_name, button_pos, start_time):
+                    return True
             
-            # 没有找到按钮，尝试随机点击区域
-            if not buttons and time.time() - start_time < max_run_time * 0.8:
-                # 随机点击屏幕中间区域
-                screen_h, screen_w = screen.shape[:2]
-                center_x, center_y = screen_w // 2, screen_h // 2
-                
-                # 定义随机点击区域
-                x1 = center_x - 100
-                y1 = center_y - 100
-                x2 = center_x + 100
-                y2 = center_y + 100
-                
-                # 偶尔进行随机点击
-                if random.random() < 0.2:  # 20%的概率随机点击
+            # 全量扫描也没有找到按钮，尝试随机点击区域
+            if full_scan and not buttons and time.monotonic() - start_time < max_run_time * 0.8:
+                # 偶尔随机点击屏幕中间区域
+                if random.random() < self._random_click_prob:
                     logger.info("没有找到按钮，进行随机点击")
-                    if self.input_controller.random_click_area(x1, y1, x2, y2):
+                    if self.input_controller.random_click_area(*self._get_click_rect(screen)):
                         return True
             
             # 没有动作，等待一小段时间
@@ -149,6 +161,40 @@ class BaiguiModule(AutomationModule):
             
         return False
         
+    def _get_click_rect(self, screen) -> Tuple[int, int, int, int]:
+        """屏幕中间200x200的随机点击区域 (x1, y1, x2, y2)，按屏幕尺寸缓存"""
+        size = screen.shape[:2]
+        if size != self._screen_size:
+            screen_h, screen_w = size
+            center_x, center_y = screen_w // 2, screen_h // 2
+            self._screen_size = size
+            self._click_rect = (center_x - 100, center_y - 100, center_x + 100, center_y + 100)
+        return self._click_rect
+        
+    def _handle_entry(self, button_name: str, pos: Tuple[int, int], start_time: float) -> bool:
+        """进入按钮"""
+        logger.info(f"检测到进入按钮")
+        return self.click_button(button_name, pos[0], pos[1])
+        
+    def _handle_start(self, button_name: str, pos: Tuple[int, int], start_time: float) -> bool:
+        """开始按钮，点击后等待一段时间再检查结算按钮"""
+        logger.info(f"检测到开始按钮")
+        if not self.click_button(button_name, pos[0], pos[1]):
+            return False
+            
+        # 等待结束前不截图；之后按流程只匹配结算按钮
+        self._await_until = time.monotonic() + self._wait_min + random.random() * self._wait_span
+        return True
+        
+    def _handle_settlement(self, button_name: str, pos: Tuple[int, int], start_time: float) -> bool:
+        """结算按钮"""
+        logger.info(f"检测到结算按钮")
+        return self.click_button(button_name, pos[0], pos[1])
+        
+    def _handle_default(self, button_name: str, pos: Tuple[int, int], start_time: float) -> bool:
+        """其他按钮"""
+        return self.click_button(button_name, pos[0], pos[1])
+        
     def cleanup(self) -> None:
         """清理资源"""
         logger.info("清理百鬼夜行模块资源")
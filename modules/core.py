@@ -7,14 +7,22 @@ import os
 import json
 import time
 import random
+import struct
 import logging
+import functools
 import subprocess
 import threading
 import numpy as np
 import cv2
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple, Optional, Union, Any
 from datetime import datetime, timedelta
 
+try:
+    import orjson  # 可选依赖，安装后加载配置更快
+except ImportError:
+    orjson = None
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -26,16 +34,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger("AutomationCore")
 
+# 模板匹配已由线程池按模板并行，OpenCV内部不再另开线程，避免线程数超过CPU核数
+cv2.setNumThreads(1)
+
+# 配置项不存在时在缓存中的占位值
+_MISSING = object()
+
 class ConfigManager:
     """配置管理器，负责加载和提供配置信息"""
     
     def __init__(self, config_path: str = "config/settings.json"):
         self.config_path = config_path
+        self._get_cache = {}  # 点分路径 -> 配置值，配置变化时清空
         self.config = self._load_config()
         
     def _load_config(self) -> Dict:
         """加载配置文件"""
+        self._get_cache.clear()
         try:
+            if orjson is not None:
+                with open(self.config_path, 'rb') as f:
+                    return orjson.loads(f.read())
             with open(self.config_path, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except Exception as e:
@@ -44,21 +63,27 @@ class ConfigManager:
             
     def get(self, key: str, default: Any = None) -> Any:
         """获取配置项"""
-        keys = key.split('.')
-        value = self.config
-        
         try:
-            for k in keys:
-                value = value[k]
-            return value
-        except (KeyError, TypeError):
-            return default
+            value = self._get_cache[key]
+        except KeyError:
+            value = self.config
+            try:
+                for k in key.split('.'):
+                    value = value[k]
+            except (KeyError, TypeError):
+                value = _MISSING
+            self._get_cache[key] = value
+        return default if value is _MISSING else value
             
     def save(self) -> bool:
-        """保存配置到文件"""
+        """保存配置到文件（先写临时文件再替换，写入中断不会损坏原配置）"""
+        tmp_path = self.config_path + ".tmp"
         try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(self.config, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.config_path)
             return True
         except Exception as e:
             logger.error(f"保存配置文件失败: {str(e)}")
@@ -66,6 +91,7 @@ class ConfigManager:
             
     def update(self, key: str, value: Any) -> None:
         """更新配置项"""
+        self._get_cache.clear()
         keys = key.split('.')
         current = self.config
         
@@ -86,9 +112,51 @@ class DeviceManager:
         self.config = config_manager
         self.adb_path = self.config.get("adb_path", "adb")
         self.devices = []  # [(device_id, device_info), ...]
+        self._device_ids = set()  # self.devices中的device_id，用于快速判断是否已添加
         self.active_device = None
         self.last_device_switch_time = 0
         self.switch_interval = self.config.get("device_management.switch_interval", 30)
+        # 每个设备一个常驻的adb shell进程，点击等命令通过它执行，避免每次启动adb进程
+        self._shells = {}  # device_id -> subprocess.Popen
+        self._shell_lock = threading.Lock()
+        
+    def _open_shell(self, device_id: str) -> subprocess.Popen:
+        """为设备启动常驻的adb shell进程"""
+        shell = subprocess.Popen(
+            [self.adb_path, "-s", device_id, "shell"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            bufsize=0
+        )
+        self._shells[device_id] = shell
+        return shell
+        
+    def shell_command(self, device_id: str, command: str) -> None:
+        """通过常驻shell执行命令（不等待结果），shell已退出（如设备断开重连）时重新启动一次"""
+        with self._shell_lock:
+            for attempt in range(2):
+                shell = self._shells.get(device_id)
+                if shell is None or shell.poll() is not None:
+                    shell = self._open_shell(device_id)
+                try:
+                    shell.stdin.write(command.encode('utf-8') + b'\n')
+                    return
+                except OSError:
+                    self._shells.pop(device_id, None)
+                    if attempt:
+                        raise
+                        
+    def close_shells(self) -> None:
+        """关闭所有常驻的adb shell进程"""
+        with self._shell_lock:
+            for shell in self._shells.values():
+                try:
+                    shell.stdin.close()
+                    shell.wait(timeout=2)
+                except Exception:
+                    shell.kill()
+            self._shells.clear()
         
     def restart_adb_server(self) -> bool:
         """重启ADB服务器"""
@@ -113,6 +181,7 @@ class DeviceManager:
         """列出所有已连接的设备"""
         print("正在搜索设备...")
         self.devices = []
+        self._device_ids = set()
         
         # 尝试重启ADB服务器并断开所有连接
         self.disconnect_all()
@@ -134,44 +203,59 @@ class DeviceManager:
                 if line.strip() and '\t' in line:
                     device_id, status = line.split('\t')
                     if status == 'device':
-                        if not any(d[0] == device_id for d in self.devices):
-                            self.devices.append((device_id, f"设备 {device_id}"))
+                        if device_id not in self._device_ids:
+                            self._add_device(device_id, f"设备 {device_id}")
         except Exception as e:
             logger.error(f"获取设备列表失败: {str(e)}")
             
-        # 尝试连接常见的模拟器端口
+        # 并行尝试连接常见的模拟器端口，结果按端口顺序加入
         common_ports = [5555, 5556, 5557, 5558, 7555, 62001, 62025, 62026, 16384, 16416]
-        for port in common_ports:
-            device_id = f"127.0.0.1:{port}"
-            if not any(d[0] == device_id for d in self.devices):
-                try:
-                    connect_result = subprocess.run(
-                        [self.adb_path, "connect", device_id], 
-                        capture_output=True, 
-                        text=True,
-                        encoding='utf-8',
-                        errors='ignore'
-                    )
-                    if "connected" in connect_result.stdout:
-                        # 获取设备信息
-                        try:
-                            model_result = subprocess.run(
-                                [self.adb_path, "-s", device_id, "shell", "getprop ro.product.model"], 
-                                capture_output=True, 
-                                text=True,
-                                encoding='utf-8',
-                                errors='ignore'
-                            )
-                            model = model_result.stdout.strip() or f"未知设备"
-                            self.devices.append((device_id, f"{model} ({device_id})"))
-                        except:
-                            self.devices.append((device_id, f"设备 {device_id}"))
-                except Exception as e:
-                    logger.debug(f"连接设备 {device_id} 失败: {str(e)}")
+        device_ids = [f"127.0.0.1:{port}" for port in common_ports]
+        device_ids = [device_id for device_id in device_ids if device_id not in self._device_ids]
+        if device_ids:
+            with ThreadPoolExecutor(max_workers=len(device_ids)) as executor:
+                for device in executor.map(self._try_connect, device_ids):
+                    if device is not None:
+                        self._add_device(*device)
                     
         print(f"找到 {len(self.devices)} 个目标设备")
         return self.devices
         
+    def _try_connect(self, device_id: str) -> Optional[Tuple[str, str]]:
+        """尝试连接一个模拟器地址，成功时返回 (device_id, device_info)"""
+        try:
+            connect_result = subprocess.run(
+                [self.adb_path, "connect", device_id], 
+                capture_output=True, 
+                text=True,
+                encoding='utf-8',
+                errors='ignore'
+            )
+            if "connected" not in connect_result.stdout:
+                return None
+        except Exception as e:
+            logger.debug(f"连接设备 {device_id} 失败: {str(e)}")
+            return None
+            
+        # 获取设备信息
+        try:
+            model_result = subprocess.run(
+                [self.adb_path, "-s", device_id, "shell", "getprop ro.product.model"], 
+                capture_output=True, 
+                text=True,
+                encoding='utf-8',
+                errors='ignore'
+            )
+            model = model_result.stdout.strip() or f"未知设备"
+            return (device_id, f"{model} ({device_id})")
+        except:
+            return (device_id, f"设备 {device_id}")
+            
+    def _add_device(self, device_id: str, device_info: str) -> None:
+        """添加设备，同时记录其device_id"""
+        self.devices.append((device_id, device_info))
+        self._device_ids.add(device_id)
+        
     def select_device(self, index: Optional[int] = None) -> Optional[Tuple[str, str]]:
         """选择一个设备"""
         if not self.devices:
@@ -228,20 +312,72 @@ class DeviceManager:
             return self.active_device[0]
         return None
 
+@functools.lru_cache(maxsize=128)
+def _read_template(template_path: str, mtime_ns: int) -> Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+    """
+    读取模板图像，返回 (BGR, 灰度, 1/4分辨率灰度)；模板太小时1/4分辨率版本为None
+    以修改时间作为缓存键，文件变化后自动重新读取
+    """
+    template = cv2.imread(template_path)
+    if template is None:
+        return None
+    gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+    quarter = None
+    if min(gray.shape[:2]) >= ImageProcessor.PYRAMID_MIN_SIZE:
+        quarter = cv2.pyrDown(cv2.pyrDown(gray))
+    return template, gray, quarter
+
 class ImageProcessor:
     """图像处理器，负责屏幕截图和图像识别"""
     
+    # 所有设备共用的模板匹配线程池，cv2.matchTemplate执行时会释放GIL
+    _match_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix='match')
+    # 模板文件修改时间的检查间隔（秒），间隔内直接使用已加载的模板
+    TEMPLATE_CHECK_INTERVAL = 2.0
+    # 上次命中位置向四周扩展的像素数，下一帧先在这个区域内匹配
+    LAST_HIT_PADDING = 100
+    # 全屏匹配先在1/4分辨率上粗匹配：模板边长不小于该值时才缩小（缩小后至少8像素）
+    PYRAMID_MIN_SIZE = 32
+    # 粗匹配分数低于 阈值-该值 时直接判定未命中，否则在候选位置附近用原分辨率精确匹配
+    PYRAMID_MARGIN = 0.2
+    # 每个线程最多保留的matchTemplate结果缓冲区个数，超过时全部丢弃重新分配
+    MAX_RESULT_BUFFERS = 32
+    
     def __init__(self, config_manager: ConfigManager, device_manager: DeviceManager):
         self.config = config_manager
         self.device_manager = device_manager
         self.images_dir = self.config.get("images_dir", "images")
-        self.templates = {}  # 缓存加载的模板图像
+        self.templates = {}  # 模板名 -> (上次检查文件的时间, 灰度模板图像, 1/4分辨率灰度模板或None)
         self.template_configs = {}  # 模板配置
+        # 最近一次转换的 (原始截图, 灰度图)，同一张截图只转换一次；
+        # 用单个元组保存，多个设备线程共用时也不会取到不匹配的一对
+        self._gray_cache = (None, None)
+        self._quarter_cache = (None, None)  # (灰度截图, 1/4分辨率灰度截图)
+        # 各线程按结果尺寸复用的matchTemplate结果缓冲区；匹配在线程池中并行执行，每个线程各用一份
+        self._result_local = threading.local()
+        self._last_hit = {}  # 模板名 -> 上次命中位置附近的区域 [x, y, w, h]
         self.load_template_configs()
         
     def load_template_configs(self) -> None:
         """加载模板配置"""
         self.template_configs = self.config.get("templates", {})
+        # 匹配时用到的阈值和优先级预先展开，避免每帧逐层查找
+        self._thresholds = {name: cfg.get("threshold", 0.8) for name, cfg in self.template_configs.items()}
+        self._priorities = {name: cfg.get("priority", 0) for name, cfg in self.template_configs.items()}
+        # 模板列表 -> 按优先级分层的模板名，只找最高优先级按钮时逐层匹配
+        self._priority_tiers = {}
+        
+    def _get_priority_tiers(self, template_names: List[str]) -> List[List[str]]:
+        """把模板按优先级从高到低（数值从小到大）分层，同层保持原顺序；结果按模板列表缓存"""
+        key = tuple(template_names)
+        tiers = self._priority_tiers.get(key)
+        if tiers is None:
+            by_priority = {}
+            for name in template_names:
+                by_priority.setdefault(self._priorities.get(name, 0), []).append(name)
+            tiers = [by_priority[priority] for priority in sorted(by_priority)]
+            self._priority_tiers[key] = tiers
+        return tiers
         
     def get_screen(self) -> Optional[np.ndarray]:
         """获取屏幕截图"""
@@ -251,94 +387,349 @@ class ImageProcessor:
             return None
             
         try:
-            # 使用ADB截图
-            subprocess.run(
-                [self.device_manager.adb_path, "-s", device_id, "shell", "screencap", "-p", "/sdcard/screen.png"],
-                check=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
-            
-            # 将截图拉取到本地
-            subprocess.run(
-                [self.device_manager.adb_path, "-s", device_id, "pull", "/sdcard/screen.png", "screen.png"],
-                check=True,
-                encoding='utf-8',
-                errors='ignore'
+            # 截图原始像素直接从标准输出读取，不经过PNG编解码、设备存储和本地文件
+            result = subprocess.run(
+                [self.device_manager.adb_path, "-s", device_id, "exec-out", "screencap"],
+                capture_output=True,
+                check=True
             )
             
-            # 读取截图
-            screen = cv2.imread("screen.png")
+            screen = self._decode_raw_screencap(result.stdout)
+            if screen is None:
+                # 像素格式不是RGBA_8888时改用PNG截图
+                screen = self._get_screen_png(device_id)
             return screen
         except Exception as e:
             logger.error(f"获取屏幕截图失败: {str(e)}")
             return None
             
+    def _get_screen_png(self, device_id: str) -> Optional[np.ndarray]:
+        """通过screencap -p获取PNG截图，直接在内存中解码"""
+        result = subprocess.run(
+            [self.device_manager.adb_path, "-s", device_id, "exec-out", "screencap", "-p"],
+            capture_output=True,
+            check=True
+        )
+        return cv2.imdecode(np.frombuffer(result.stdout, np.uint8), cv2.IMREAD_COLOR)
+        
+    def _decode_raw_screencap(self, raw: bytes) -> Optional[np.ndarray]:
+        """解析screencap原始输出（头部 + RGBA像素）为BGR图像"""
+        if len(raw) < 12:
+            return None
+        width, height, pixel_format = struct.unpack_from('<III', raw, 0)
+        # Android 9及以上头部为16字节（多一个colorspace字段），旧版本为12字节
+        header_size = len(raw) - width * height * 4
+        if header_size not in (12, 16) or pixel_format != 1:  # 1: RGBA_8888
+            return None
+            
+        rgba = np.frombuffer(raw, dtype=np.uint8, offset=header_size).reshape(height, width, 4)
+        screen = cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR)
+        # 匹配用的灰度图直接从RGBA转换并登记，避免再从BGR转换一次
+        self._gray_cache = (screen, cv2.cvtColor(rgba, cv2.COLOR_RGBA2GRAY))
+        return screen
+            
     def load_template(self, template_name: str) -> Optional[np.ndarray]:
-        """加载模板图像"""
-        if template_name in self.templates:
-            return self.templates[template_name]
+        """加载模板图像（灰度，匹配时的计算量约为三通道的1/3），模板文件修改后自动重新加载"""
+        now = time.monotonic()
+        entry = self.templates.get(template_name)
+        if entry is not None and now - entry[0] < self.TEMPLATE_CHECK_INTERVAL:
+            return entry[1]
             
         template_path = os.path.join(self.images_dir, f"{template_name}.png")
-        if not os.path.exists(template_path):
+        try:
+            mtime_ns = os.stat(template_path).st_mtime_ns
+        except OSError:
             logger.error(f"模板图像不存在: {template_path}")
             return None
             
         try:
-            template = cv2.imread(template_path)
-            self.templates[template_name] = template
-            return template
+            images = _read_template(template_path, mtime_ns)
+            if images is None:
+                logger.error(f"加载模板图像失败: {template_path}")
+                return None
+            self.templates[template_name] = (now, images[1], images[2])
+            return images[1]
         except Exception as e:
             logger.error(f"加载模板图像失败: {template_path}, {str(e)}")
             return None
             
-    def find_template(self, template_name: str, screen: np.ndarray) -> Optional[Tuple[int, int]]:
-        """在屏幕中查找模板"""
+    def get_screen_gray(self, screen: np.ndarray) -> np.ndarray:
+        """返回截图的灰度图，同一张截图只转换一次"""
+        if screen.ndim == 2:
+            return screen
+        source, gray = self._gray_cache
+        if source is not screen:
+            gray = cv2.cvtColor(screen, cv2.COLOR_BGR2GRAY)
+            self._gray_cache = (screen, gray)
+        return gray
+        
+    def get_screen_quarter(self, gray: np.ndarray) -> np.ndarray:
+        """返回灰度截图的1/4分辨率版本，同一张截图只缩小一次"""
+        source, quarter = self._quarter_cache
+        if source is not gray:
+            quarter = cv2.pyrDown(cv2.pyrDown(gray))
+            self._quarter_cache = (gray, quarter)
+        return quarter
+        
+    def crop_roi(self, screen: np.ndarray, template: np.ndarray,
+                 roi: Optional[Tuple[int, int, int, int]]) -> Tuple[np.ndarray, int, int]:
+        """
+        按ROI [x, y, w, h] 截取屏幕区域（视图，不复制），返回 (区域, x偏移, y偏移)
+        ROI为空、越界或容纳不下模板时返回整个屏幕
+        """
+        if roi is None:
+            return screen, 0, 0
+        x, y, w, h = roi
+        screen_h, screen_w = screen.shape[:2]
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(screen_w, x + w), min(screen_h, y + h)
+        th, tw = template.shape[:2]
+        if x2 - x1 < tw or y2 - y1 < th:
+            return screen, 0, 0
+        return screen[y1:y2, x1:x2], x1, y1
+        
+    def _result_buffer(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """取当前线程中指定尺寸的float32结果缓冲区，不存在时分配"""
+        buffers = getattr(self._result_local, 'buffers', None)
+        if buffers is None:
+            buffers = self._result_local.buffers = {}
+        buffer = buffers.get(shape)
+        if buffer is None:
+            # ROI在屏幕边缘被截断时结果尺寸会变化，缓冲区过多时清空
+            if len(buffers) >= self.MAX_RESULT_BUFFERS:
+                buffers.clear()
+            buffer = buffers[shape] = np.empty(shape, np.float32)
+        return buffer
+        
+    def _match(self, template: np.ndarray, screen: np.ndarray,
+               roi: Optional[Tuple[int, int, int, int]] = None,
+               threshold: Optional[float] = None) -> Tuple[float, Tuple[int, int], int, int]:
+        """
+        匹配一次模板，返回 (最高分, 最佳位置左上角的屏幕坐标, 模板高, 模板宽)
+        指定threshold且最高分未达到时不再求最佳位置，返回的位置为区域左上角
+        """
+        region, offset_x, offset_y = self.crop_roi(self.get_screen_gray(screen), template, roi)
+        h, w = template.shape[:2]
+        result = self._result_buffer((region.shape[0] - h + 1, region.shape[1] - w + 1))
+        cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED, result=result)
+        # 大多数模板不在画面上，只求最大值比minMaxLoc同时求最小值和两个位置快一倍
+        max_val = float(result.max())
+        if threshold is not None and max_val < threshold:
+            return max_val, (offset_x, offset_y), h, w
+        y, x = divmod(int(result.argmax()), result.shape[1])
+        return max_val, (offset_x + x, offset_y + y), h, w
+        
+    def _match_pyramid(self, template_name: str, template: np.ndarray, screen: np.ndarray,
+                       threshold: float) -> Tuple[float, Tuple[int, int], int, int]:
+        """
+        全屏匹配：先在1/4分辨率上粗匹配，分数接近阈值时再在候选位置附近用原分辨率精确匹配
+        模板太小没有1/4版本时直接全屏匹配。返回值与_match相同
+        """
+        entry = self.templates.get(template_name)
+        quarter = entry[2] if entry is not None and entry[1] is template else None
+        if quarter is None:
+            return self._match(template, screen, threshold=threshold)
+            
+        small = self.get_screen_quarter(self.get_screen_gray(screen))
+        if small.shape[0] < quarter.shape[0] or small.shape[1] < quarter.shape[1]:
+            return self._match(template, screen, threshold=threshold)
+        max_val, (x, y), _, _ = self._match(quarter, small, threshold=threshold - self.PYRAMID_MARGIN)
+        h, w = template.shape[:2]
+        if max_val < threshold - self.PYRAMID_MARGIN:
+            return max_val, (x * 4, y * 4), h, w
+            
+        # 1/4分辨率下的位置误差在4像素以内，留出8像素余量
+        pad = 8
+        return self._match(template, screen, (x * 4 - pad, y * 4 - pad, w + 2 * pad, h + 2 * pad), threshold)
+        
+    def _match_tracked(self, template_name: str, template: np.ndarray, screen: np.ndarray,
+                       roi: Optional[Tuple[int, int, int, int]],
+                       threshold: float) -> Tuple[float, Tuple[int, int], int, int]:
+        """
+        未指定roi时先在模板上次命中位置附近匹配，未达到阈值再全屏匹配；
+        全屏命中时记录新位置。返回值与_match相同
+        """
+        if roi is not None:
+            return self._match(template, screen, roi, threshold)
+            
+        last_hit = self._last_hit.get(template_name)
+        if last_hit is not None:
+            match = self._match(template, screen, last_hit, threshold)
+            if match[0] >= threshold:
+                return match
+                
+        match = self._match_pyramid(template_name, template, screen, threshold)
+        max_val, (x, y), h, w = match
+        if max_val >= threshold:
+            pad = self.LAST_HIT_PADDING
+            self._last_hit[template_name] = (x - pad, y - pad, w + 2 * pad, h + 2 * pad)
+        return match
+        
+    def find_template(self, template_name: str, screen: np.ndarray,
+                      roi: Optional[Tuple[int, int, int, int]] = None) -> Optional[Tuple[int, int]]:
+        """在屏幕中查找模板，指定roi时只在该区域内匹配"""
         template = self.load_template(template_name)
         if template is None or screen is None:
             return None
             
         # 获取阈值配置
-        threshold = self.template_configs.get(template_name, {}).get("threshold", 0.8)
+        threshold = self._thresholds.get(template_name, 0.8)
         
         # 使用模板匹配
-        result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-        
+        max_val, max_loc, h, w = self._match_tracked(template_name, template, screen, roi, threshold)
         if max_val >= threshold:
             # 计算中心点坐标
-            h, w = template.shape[:2]
-            center_x = max_loc[0] + w // 2
-            center_y = max_loc[1] + h // 2
-            return (center_x, center_y)
+            return (max_loc[0] + w // 2, max_loc[1] + h // 2)
             
         return None
         
-    def detect_all_buttons(self, screen: np.ndarray, template_names: List[str]) -> List[Dict]:
-        """检测屏幕上的所有按钮"""
-        results = []
+    def _rank_buttons(self, names: List[str], positions: List[Tuple[int, int]],
+                      scores: List[float], first_only: bool) -> List[Dict]:
+        """
+        按优先级排列命中的按钮，优先级高（数值小）的排在前面，同优先级保持检测顺序
+        命中结果以并列数组保存，只为返回的按钮生成字典；first_only时只返回优先级最高的一个
+        """
+        if not names:
+            return []
+        priorities = np.fromiter((self._priorities.get(name, 0) for name in names),
+                                 dtype=np.float64, count=len(names))
+        if first_only:
+            order = [int(np.argmin(priorities))]
+        else:
+            order = np.argsort(priorities, kind='stable')
+        return [
+            {
+                "name": names[i],
+                "position": positions[i],
+                "score": scores[i],
+                "priority": self._priorities.get(names[i], 0)
+            }
+            for i in order
+        ]
+        
+    def detect_all_buttons(self, screen: np.ndarray, template_names: List[str],
+                           roi: Optional[Tuple[int, int, int, int]] = None,
+                           first_only: bool = False) -> List[Dict]:
+        """检测屏幕上的所有按钮，指定roi时只在该区域内匹配；first_only时只返回优先级最高的按钮"""
+        if screen is None:
+            return []
+            
+        gray = self.get_screen_gray(screen)
+        if first_only:
+            # 从最高优先级开始逐层匹配，某一层有命中即可返回，不再匹配更低优先级的模板
+            for tier in self._get_priority_tiers(template_names):
+                names, positions, scores = self._match_names(gray, tier, roi)
+                if names:
+                    return self._rank_buttons(names, positions, scores, True)
+            return []
+            
+        names, positions, scores = self._match_names(gray, template_names, roi)
+        return self._rank_buttons(names, positions, scores, False)
         
+    def _match_names(self, gray: np.ndarray, template_names: List[str],
+                     roi: Optional[Tuple[int, int, int, int]]) -> Tuple[List[str], List[Tuple[int, int]], List[float]]:
+        """并行匹配一组模板，返回命中模板的 (名称, 中心位置, 分数) 并列列表"""
+        # 各模板并行匹配，一次匹配同时得到位置和分数
+        futures = []
         for template_name in template_names:
-            pos = self.find_template(template_name, screen)
-            if pos:
-                # 获取匹配分数
-                template = self.load_template(template_name)
-                result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-                min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+            template = self.load_template(template_name)
+            if template is not None:
+                threshold = self._thresholds.get(template_name, 0.8)
+                future = self._match_pool.submit(self._match_tracked, template_name, template, gray, roi, threshold)
+                futures.append((template_name, threshold, future))
                 
-                # 获取优先级
-                priority = self.template_configs.get(template_name, {}).get("priority", 0)
+        names, positions, scores = [], [], []
+        for template_name, threshold, future in futures:
+            max_val, max_loc, h, w = future.result()
+            if max_val >= threshold:
+                names.append(template_name)
+                positions.append((max_loc[0] + w // 2, max_loc[1] + h // 2))
+                scores.append(max_val)
+        return names, positions, scores
+        
+    def group_templates(self, template_names: List[str]) -> Dict[Tuple[int, int], Tuple[np.ndarray, List[str], np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        按尺寸分组模板，供detect_all_buttons_batched使用
+        返回 {(h, w): (堆叠后的模板数组, 模板名列表, 阈值数组, 优先级数组, 模板在原列表中的下标数组)}，
+        加载失败的模板会被跳过
+        """
+        groups = {}
+        for index, template_name in enumerate(template_names):
+            template = self.load_template(template_name)
+            if template is not None:
+                groups.setdefault(template.shape[:2], []).append((index, template_name))
+        return {
+            size: (
+                np.stack([self.load_template(name) for _, name in members]),
+                [name for _, name in members],
+                np.array([self._thresholds.get(name, 0.8) for _, name in members], dtype=np.float32),
+                np.array([self._priorities.get(name, 0) for _, name in members], dtype=np.float64),
+                np.array([index for index, _ in members], dtype=np.int64)
+            )
+            for size, members in groups.items()
+        }
+        
+    def detect_all_buttons_batched(self, screen: np.ndarray,
+                                   groups: Dict[Tuple[int, int], Tuple[np.ndarray, List[str], np.ndarray, np.ndarray, np.ndarray]],
+                                   roi: Optional[Tuple[int, int, int, int]] = None,
+                                   first_only: bool = False) -> List[Dict]:
+        """
+        按尺寸分组检测按钮，参数和结果格式与detect_all_buttons相同
+        同组模板的匹配结果写入同一个三维数组，再用一次argmax求出每个模板的最佳位置；
+        每个模板只匹配一次，阈值判断和优先级选择都在数组上完成
+        """
+        if screen is None:
+            return []
+            
+        hit_names, positions, hit_scores, hit_orders = [], [], [], []
+        best_key = (np.inf, np.inf)
+        gray = self.get_screen_gray(screen)
+        for (h, w), (stack, names, thresholds, priorities, orders) in groups.items():
+            region, offset_x, offset_y = self.crop_roi(gray, stack[0], roi)
+            result_h = region.shape[0] - h + 1
+            result_w = region.shape[1] - w + 1
+            scores = self._result_buffer((len(names), result_h, result_w))
+            # 同组模板并行写入各自的结果切片
+            futures = [
+                self._match_pool.submit(cv2.matchTemplate, region, template, cv2.TM_CCOEFF_NORMED, result=scores[i])
+                for i, template in enumerate(stack)
+            ]
+            for future in futures:
+                future.result()
                 
-                results.append({
-                    "name": template_name,
-                    "position": pos,
-                    "score": max_val,
-                    "priority": priority
-                })
+            flat = scores.reshape(len(names), -1)
+            best = flat.argmax(axis=1)
+            best_scores = flat[np.arange(len(names)), best]
+            valid = best_scores >= thresholds
+            
+            if first_only:
+                # 未达到阈值的模板优先级视为无穷大，argmin即为本组优先级最高的命中（同优先级取组内靠前的）
+                masked = np.where(valid, priorities, np.inf)
+                i = int(masked.argmin())
+                # 不同组之间同优先级时按模板在原列表中的顺序比较，与detect_all_buttons一致
+                key = (masked[i], orders[i])
+                if not valid[i] or not key < best_key:
+                    continue
+                best_key = key
+                hit_names, positions, hit_scores, hit_orders = [], [], [], []
+                candidates = [i]
+            else:
+                candidates = np.flatnonzero(valid)
                 
-        # 按优先级排序，优先级高（数值小）的排在前面
-        results.sort(key=lambda x: x["priority"])
-        return results
+            for i in candidates:
+                y, x = divmod(int(best[i]), result_w)
+                hit_names.append(names[i])
+                positions.append((offset_x + x + w // 2, offset_y + y + h // 2))
+                hit_scores.append(float(best_scores[i]))
+                hit_orders.append(int(orders[i]))
+                
+        # 命中结果按组收集，恢复成模板列表的顺序后再排序，同优先级的按钮保持模板列表顺序
+        if len(hit_orders) > 1:
+            ranked = sorted(range(len(hit_orders)), key=hit_orders.__getitem__)
+            hit_names = [hit_names[i] for i in ranked]
+            positions = [positions[i] for i in ranked]
+            hit_scores = [hit_scores[i] for i in ranked]
+        return self._rank_buttons(hit_names, positions, hit_scores, first_only)
 
 class InputController:
     """输入控制器，负责模拟点击和输入"""
@@ -347,6 +738,14 @@ class InputController:
         self.device_manager = device_manager
         self.config = config_manager
         self.last_click = None
+        self.load_delay_configs()
+        
+    def load_delay_configs(self) -> None:
+        """加载各模板点击后的延迟范围，预先展开避免每次点击逐层查找"""
+        self._delays = {
+            name: tuple(cfg.get("delay_after", (0.5, 1.0)))
+            for name, cfg in self.config.get("templates", {}).items()
+        }
         
     def click(self, x: int, y: int) -> bool:
         """模拟点击屏幕"""
@@ -356,12 +755,7 @@ class InputController:
             return False
             
         try:
-            subprocess.run(
-                [self.device_manager.adb_path, "-s", device_id, "shell", "input", "tap", str(x), str(y)],
-                check=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
+            self.device_manager.shell_command(device_id, f"input tap {x} {y}")
             self.last_click = (x, y, time.time())
             return True
         except Exception as e:
@@ -392,12 +786,8 @@ class InputController:
     def random_delay(self, template_name: str = None) -> None:
         """执行随机延迟"""
         # 获取模板特定的延迟配置或使用默认值
-        if template_name:
-            delay_range = self.config.get(f"templates.{template_name}.delay_after", [0.5, 1.0])
-        else:
-            delay_range = [0.5, 1.0]
-            
-        delay = random.uniform(delay_range[0], delay_range[1])
+        delay_min, delay_max = self._delays.get(template_name, (0.5, 1.0))
+        delay = random.uniform(delay_min, delay_max)
         time.sleep(delay)
         
     def random_click_area(self, x1: int, y1: int, x2: int, y2: int) -> bool:
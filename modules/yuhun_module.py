@@ -8,7 +8,6 @@ import random
 import logging
 from typing import Dict, List, Tuple, Optional
 import threading
-from datetime import datetime
 from modules.core import ConfigManager, DeviceManager, ImageProcessor, InputController
 from modules.automation_engine import AutomationModule
 
@@ -39,29 +38,31 @@ class YuhunModule(AutomationModule):
         
         # 状态标志
         self.check_notupo_after_button10 = False
-        self.last_button10_click_time = 0
+        self._notupo_deadline = 0.0  # 点击button10后检查notupo的截止时间（单调时钟）
         
     def initialize(self) -> bool:
         """初始化模块"""
         logger.info(f"初始化御魂模块")
         # 可以在这里加载御魂特有的资源
+        # 缓存run_once中用到的配置，避免每次调用都按路径查找
+        self._max_run_time = self.config.get("device_management.max_single_run_time", 5)  # 最长5秒
         return True
         
     def run_once(self, stop_event: threading.Event, pause_event: threading.Event) -> bool:
         """运行一次御魂自动化流程"""
         # 添加最大执行时间限制
-        max_run_time = self.config.get("device_management.max_single_run_time", 5)  # 最长5秒
-        start_time = time.time()
+        max_run_time = self._max_run_time
+        start_time = time.monotonic()
         
         while not stop_event.is_set():
             # 检查是否超过最大执行时间
-            if time.time() - start_time > max_run_time:
+            if time.monotonic() - start_time > max_run_time:
                 return False  # 超过最大执行时间，退出本次run调用
                 
             try:
                 # 检查是否需要暂停
                 if pause_event.is_set():
-                    time.sleep(1)
+                    pause_event.wait_cleared(1)
                     return False
                 
                 # 多设备支持：检查是否需要切换设备
@@ -78,26 +79,20 @@ class YuhunModule(AutomationModule):
                 # 检查lose和notupo
                 lose_pos = self.image_processor.find_template("lose", screen)
                 if lose_pos:
-                    logger.info(f"{datetime.now().strftime('%H:%M:%S')} - 检测到lose")
+                    logger.info("检测到lose")
                     pause_event.set()
                     return False
                 
                 # 如果刚点击了button10，立即检查notupo
                 if self.check_notupo_after_button10:
-                    notupo_pos = self.image_processor.find_template("notupo", screen)
-                    if notupo_pos:
-                        logger.info(f"{datetime.now().strftime('%H:%M:%S')} - 检测到notupo")
-                        pause_event.set()
-                        return False
-                    # 如果距离点击button10超过1秒还没检测到notupo，就继续正常流程
-                    if time.time() - self.last_button10_click_time > 1:
-                        self.check_notupo_after_button10 = False
-                    else:
-                        time.sleep(0.1)
+                    state = self._poll_notupo(screen, pause_event)
+                    if state is None:
                         continue
+                    if not state:
+                        return False
                 
                 # 检测屏幕上的所有按钮
-                buttons = self.image_processor.detect_all_buttons(screen, self.template_sets)
+                buttons = self.image_processor.detect_all_buttons(screen, self.template_sets, first_only=True)
                 
                 # 如果找到了按钮，点击优先级最高的
                 if buttons:
@@ -118,7 +113,7 @@ class YuhunModule(AutomationModule):
                     # 特殊处理button10
                     if button_name == "button10":
                         if self.click_button(button_name, button_pos[0], button_pos[1]):
-                            self.last_button10_click_time = time.time()
+                            self._notupo_deadline = time.monotonic() + 1
                             self.check_notupo_after_button10 = True
                             return True
                     
@@ -127,7 +122,7 @@ class YuhunModule(AutomationModule):
                         # 等待特定时间
                         wait_time = random.uniform(0.5, 1.5)
                         # 检查是否会超时
-                        if time.time() - start_time + wait_time > max_run_time:
+                        if time.monotonic() - start_time + wait_time > max_run_time:
                             return False  # 等待会导致超时，所以直接返回
                         time.sleep(wait_time)
                         
@@ -148,6 +143,23 @@ class YuhunModule(AutomationModule):
                 
         return False
         
+    def _poll_notupo(self, screen, pause_event: threading.Event) -> Optional[bool]:
+        """
+        点击button10后的notupo检查
+        返回False：检测到notupo，已暂停；None：继续等待下一帧；True：超时未出现，继续正常流程
+        """
+        if self.image_processor.find_template("notupo", screen):
+            logger.info("检测到notupo")
+            pause_event.set()
+            return False
+            
+        # 如果点击button10超过1秒还没检测到notupo，就继续正常流程
+        if time.monotonic() > self._notupo_deadline:
+            self.check_notupo_after_button10 = False
+            return True
+        time.sleep(0.1)
+        return None
+        
     def cleanup(self) -> None:
         """清理资源"""
         logger.info("清理御魂模块资源")